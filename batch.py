@@ -0,0 +1,523 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Run angle extraction for a whole dataset using a pool of worker processes.
+# This is shared by the GUI (main.py) and the command line interface (cli.py)
+# so it must not import PyQt6.
+
+# pylint: disable=R0913 # Too many arguments (too-many-arguments)
+
+import os
+import sys
+import time
+import queue
+from contextlib import ExitStack
+
+import sys_utils
+from extract import (get_angles_from_image, get_sweep_angles_from_image,
+                     PhotoIndex, is_mask_file, estimate_task_memory)
+from results import (CsvResultSink, SweepCsvSink, ColumnarResultSink, file_error_record,
+                     ERROR_FILE)
+from manifest import Manifest, get_input_state
+from cache import ArtifactCache
+from timings import StageTimer
+
+# seconds between evicting the cache while watching,
+# so it stays under its size if the watch runs for days.
+CACHE_EVICT_INTERVAL = 60
+
+
+def list_seg_fnames(seed_seg_dir):
+    """ seed segmentation file names to extract angles from """
+    seg_fnames = os.listdir(seed_seg_dir)
+    return [s for s in seg_fnames if is_mask_file(s)]
+
+
+def extract_file(root_seg_dir, im_dataset_dir, seed_seg_dir,
+                 max_seed_points_per_im, inner_radius, outer_radius,
+                 debug_image_dir, save_debug_image, fname, **kwargs):
+    """
+    Run in a worker process. Returns the records for {fname}
+    and the timings record with the time spent in each stage.
+    If the file fails, the error is returned as a record
+    so the rest of the dataset is still processed.
+    """
+    timer = StageTimer()
+    try:
+        records = get_angles_from_image(root_seg_dir, im_dataset_dir,
+                                        seed_seg_dir, max_seed_points_per_im,
+                                        inner_radius, outer_radius,
+                                        debug_image_dir, save_debug_image,
+                                        fname, timer=timer, **kwargs)
+    except Exception as error:
+        print(fname, error, file=sys.stderr)
+        records = [file_error_record(fname, error)]
+    seeds = len([r for r in records if r['seed_index'] != 'NA'])
+    return records, timer.get_record(fname, seeds)
+
+
+def extract_task(root_seg_dir, im_dataset_dir, seed_seg_dir,
+                 max_seed_points_per_im, inner_radius, outer_radius,
+                 debug_image_dir, save_debug_image, task, **kwargs):
+    """ extract_file for a (fname, photo) task from extract_angles """
+    fname, photo = task
+    return extract_file(root_seg_dir, im_dataset_dir, seed_seg_dir,
+                        max_seed_points_per_im, inner_radius, outer_radius,
+                        debug_image_dir, save_debug_image, fname,
+                        photo=photo, **kwargs)
+
+
+def sweep_file(root_seg_dir, seed_seg_dir, max_seed_points_per_im,
+               radius_pairs, fname, **kwargs):
+    """ Run in a worker process. Returns the sweep records for {fname},
+        or an error record if the file fails. """
+    try:
+        return get_sweep_angles_from_image(root_seg_dir, seed_seg_dir,
+                                           max_seed_points_per_im,
+                                           radius_pairs, fname, **kwargs)
+    except Exception as error:
+        print(fname, error, file=sys.stderr)
+        return [file_error_record(fname, error)]
+
+
+def has_file_error(records):
+    """ True if the file for {records} failed, i.e a missing photo or
+        root segmentation, so it should be processed again next time """
+    return any(r['error_code'] == ERROR_FILE for r in records)
+
+
+def get_error_messages(records):
+    return [f"File: {r['file_name']}, Error: {r['error_message']}"
+            for r in records if r['error_message']]
+
+
+def get_run_params(max_seed_points_per_im, inner_radius, outer_radius,
+                   save_debug_image, roi_skeleton):
+    """ parameters of a run, as stored in the manifest and results database.
+        Files are only resumed if they were completed with the same ones. """
+    return {'max_seed_points_per_im': max_seed_points_per_im,
+            'inner_radius': inner_radius, 'outer_radius': outer_radius,
+            'save_debug_image': save_debug_image,
+            'roi_skeleton': roi_skeleton}
+
+
+def get_timings_csv_path(output_csv_path):
+    """ timings.csv, next to the angles csv at {output_csv_path} """
+    return os.path.join(os.path.dirname(output_csv_path), 'timings.csv')
+
+
+def open_cache(cache_dir, cache_max_bytes):
+    """ ArtifactCache in {cache_dir}, or None if cache_dir is None """
+    if cache_dir is None:
+        return None
+    return ArtifactCache(cache_dir, cache_max_bytes)
+
+
+def get_run_dirs(root_seg_dir, seed_seg_dir, photo_dir, output_csv_path):
+    """ directories of a run, as stored in the results database """
+    return {'root_seg_dir': os.path.abspath(root_seg_dir),
+            'seed_seg_dir': os.path.abspath(seed_seg_dir),
+            'photo_dir': os.path.abspath(photo_dir),
+            'output_dir': os.path.abspath(os.path.dirname(output_csv_path))}
+
+
+def get_input_bytes(input_state):
+    """ bytes of the segmentations in {input_state} from get_input_state """
+    return sum(s[0] for s in input_state.values() if s is not None)
+
+
+def get_activity_hooks(activity_hook, tasks, inputs):
+    """
+    on_start for stream_process and on_done(fname, records, timings),
+    which call activity_hook(event, fname, info) with:
+    'run', None, {'files', 'bytes'} for the {tasks} to process,
+    'start', fname, {'pid', 'time'} when a worker starts a file and
+    'done', fname, {'seeds', 'bytes', 'timings'} when it completes.
+    bytes are the size of the segmentations from their {inputs}.
+    Returns None, None if there is no activity_hook.
+    """
+    if activity_hook is None:
+        return None, None
+    activity_hook('run', None, {'files': len(tasks),
+                                'bytes': sum(get_input_bytes(inputs[f]) for f, _ in tasks)})
+
+    def on_start(pid, task, start_time):
+        activity_hook('start', task[0], {'pid': pid, 'time': start_time})
+
+    def on_done(fname, records, timings):
+        activity_hook('done', fname, {
+            'seeds': sum(1 for r in records if r['seed_index'] != 'NA'),
+            'bytes': get_input_bytes(inputs[fname]), 'timings': timings})
+    return on_start, on_done
+
+
+def extract_angles(root_seg_dir, im_dataset_dir, seed_seg_dir,
+                   max_seed_points_per_im, debug_image_dir,
+                   output_csv_path, error_csv_path,
+                   inner_radius=220, outer_radius=300,
+                   save_debug_image=True, roi_skeleton=True,
+                   cpus=os.cpu_count(),
+                   seg_fnames=None, progress_hook=None, resume=False,
+                   cache_dir=None, cache_max_bytes=1024 ** 3,
+                   memory_budget=None, mmap_dir=None, columnar_path=None,
+                   sqlite_path=None, activity_hook=None):
+    """
+    Extract angles from every seed segmentation in {seed_seg_dir}
+    using {cpus} worker processes.
+
+    The workers return records and only this process writes
+    angles.csv, errors.csv and timings.csv, which has the
+    time spent in each stage for each file.
+    Completed files are recorded in a manifest in the output folder.
+    Files that failed (see has_file_error) are not, so they are tried again.
+    If resume is True then files already completed with the same
+    inputs and parameters are skipped and their results are kept.
+    If cache_dir is given then seed points and skeletons are cached there
+    and reused by later runs on the same files, i.e when tuning the radii.
+    The least recently used entries are removed at the end of the run
+    so the cache stays under cache_max_bytes.
+    If memory_budget (bytes) is given then files are only started while
+    the estimated memory for the files in progress is within the budget,
+    so large images are processed by fewer workers at once.
+    If mmap_dir is given then the root segmentations are converted to
+    memory mapped arrays there (see extract.load_mask_mmap), so only the
+    regions around the seeds are read. This is for images that are too
+    big to process in memory.
+    If columnar_path (.parquet or .feather) is given then every record is
+    also written there with typed columns (see results.ColumnarResultSink).
+    It only has the files processed by this run, not those kept by resume.
+    If sqlite_path is given then the run, its parameters and the records
+    and timings for the files it processes are added to the database there
+    (see results_db.SqliteResultSink), which can hold many runs.
+    progress_hook(completed, total) is called as each file completes.
+    activity_hook(event, fname, info) is called for the progress window,
+    see get_activity_hooks.
+    Returns a list of error messages.
+    """
+    if seg_fnames is None:
+        seg_fnames = list_seg_fnames(seed_seg_dir)
+
+    if not os.path.isdir(debug_image_dir):
+        os.makedirs(debug_image_dir)
+
+    params = get_run_params(max_seed_points_per_im, inner_radius, outer_radius,
+                            save_debug_image, roi_skeleton)
+    manifest = Manifest(os.path.dirname(output_csv_path), params, resume)
+    inputs = {f: get_input_state(root_seg_dir, seed_seg_dir, f) for f in seg_fnames}
+    done = set(f for f in seg_fnames if manifest.is_done(f, inputs[f]))
+    if done:
+        print('Resuming,', len(done), 'of', len(seg_fnames), 'files already complete',
+              file=sys.stderr)
+
+    # list the photos once here rather than searching for each photo in
+    # the workers. They are only needed for the debug images, so without
+    # them the photo directory is not read (and does not have to exist).
+    photos = PhotoIndex(im_dataset_dir) if save_debug_image else None
+    tasks = [(f, photos.get_photo(f) if photos is not None else None)
+             for f in seg_fnames if f not in done]
+
+    cache = open_cache(cache_dir, cache_max_bytes)
+
+    on_start, on_done = get_activity_hooks(activity_hook, tasks, inputs)
+    errors = []
+    timings_csv_path = get_timings_csv_path(output_csv_path)
+    with ExitStack() as stack:
+        columnar = None
+        if columnar_path is not None:
+            columnar = stack.enter_context(ColumnarResultSink(columnar_path, inner_radius,
+                                                              outer_radius))
+        database = None
+        if sqlite_path is not None:
+            # sqlite3 is only imported when it is used, so workers do not load it.
+            from results_db import SqliteResultSink # pylint: disable=C0415
+            database = stack.enter_context(SqliteResultSink(
+                sqlite_path, params, get_run_dirs(root_seg_dir, seed_seg_dir,
+                                                  im_dataset_dir, output_csv_path)))
+        sink = stack.enter_context(CsvResultSink(output_csv_path, error_csv_path,
+                                                 manifest=manifest, keep_files=done,
+                                                 timings_csv_path=timings_csv_path))
+        results = sys_utils.stream_process(
+            func=extract_task,
+            repeat_args=[
+                root_seg_dir, im_dataset_dir,
+                seed_seg_dir, max_seed_points_per_im,
+                inner_radius,
+                outer_radius,
+                debug_image_dir,
+                save_debug_image
+            ],
+            fnames=tasks,
+            cpus=cpus,
+            repeat_kwargs={'roi_skeleton': roi_skeleton, 'cache': cache,
+                           'mmap_dir': mmap_dir},
+            memory_budget=memory_budget,
+            estimate_memory=lambda task: estimate_task_memory(
+                os.path.join(root_seg_dir, task[0]), os.path.join(seed_seg_dir, task[0]),
+                roi_skeleton, mmap_dir),
+            on_start=on_start)
+        for completed, ((fname, _), (records, timings)) in enumerate(results,
+                                                                     start=len(done) + 1):
+            if on_done is not None:
+                on_done(fname, records, timings)
+            if columnar is not None:
+                columnar.write(records, timings)
+            if database is not None:
+                database.write(records, timings)
+            # failed files are not marked as complete, so resume tries them again.
+            manifest_entry = None
+            if not has_file_error(records):
+                manifest_entry = manifest.get_entry(fname, inputs[fname])
+            sink.write(records, manifest_entry, timings)
+            errors += get_error_messages(records)
+            if progress_hook is not None:
+                progress_hook(completed, len(seg_fnames))
+    manifest.close()
+    if cache is not None:
+        cache.evict()
+    return errors
+
+
+def sweep_angles(root_seg_dir, seed_seg_dir, max_seed_points_per_im,
+                 radius_pairs, sweep_csv_path, roi_skeleton=True,
+                 cpus=os.cpu_count(), seg_fnames=None, progress_hook=None,
+                 cache_dir=None, cache_max_bytes=1024 ** 3,
+                 memory_budget=None, mmap_dir=None):
+    """
+    Extract angles for every (inner_radius, outer_radius) in {radius_pairs}
+    and write them to a single long format csv at {sweep_csv_path}.
+    Each image is loaded and skeletonized once for all the pairs, so a
+    sweep costs little more than a single run with the biggest outer radius.
+    memory_budget and mmap_dir are used as in extract_angles.
+    progress_hook(completed, total) is called as each file completes.
+    Returns a list of error messages for files that failed.
+    """
+    if seg_fnames is None:
+        seg_fnames = list_seg_fnames(seed_seg_dir)
+
+    cache = open_cache(cache_dir, cache_max_bytes)
+
+    errors = []
+    with SweepCsvSink(sweep_csv_path) as sink:
+        results = sys_utils.stream_process(
+            func=sweep_file,
+            repeat_args=[root_seg_dir, seed_seg_dir,
+                         max_seed_points_per_im, list(radius_pairs)],
+            fnames=seg_fnames,
+            cpus=cpus,
+            repeat_kwargs={'roi_skeleton': roi_skeleton, 'cache': cache,
+                           'mmap_dir': mmap_dir},
+            memory_budget=memory_budget,
+            estimate_memory=lambda fname: estimate_task_memory(
+                os.path.join(root_seg_dir, fname), os.path.join(seed_seg_dir, fname),
+                roi_skeleton, mmap_dir))
+        for completed, (_, records) in enumerate(results, start=1):
+            sink.write(records)
+            # angles that could not be found are in the csv, only
+            # files that failed completely are reported here.
+            errors += get_error_messages([r for r in records if 'inner_radius' not in r])
+            if progress_hook is not None:
+                progress_hook(completed, len(seg_fnames))
+    if cache is not None:
+        cache.evict()
+    return errors
+
+
+def get_watch_state(root_seg_dir, seed_seg_dir, fname, photos=None):
+    """ get_input_state for {fname} and, if {photos} (a PhotoIndex) is given,
+        the size and modification time of its photo (None if there is not
+        exactly one), so a photo that is still being written or that arrives
+        after its segmentations is noticed """
+    state = get_input_state(root_seg_dir, seed_seg_dir, fname)
+    if photos is not None:
+        state['photo'] = None
+        photo = photos.get_photo(fname)
+        if photo.path:
+            try:
+                stat = os.stat(photo.path)
+                state['photo'] = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                pass
+    return state
+
+
+def get_settled_fnames(root_seg_dir, seed_seg_dir, pending, settle_seconds, skip=(),
+                       photos=None):
+    """
+    Seed segmentations (not in {skip}) that have a root segmentation and
+    have not changed for {settle_seconds}, so they are not still being written.
+    If {photos} is given their photo must not have changed either.
+    pending maps each file name to its state (see get_watch_state)
+    and the time that state was first seen, and is updated here.
+    Files that are no longer ready (i.e deleted) are removed from pending.
+    """
+    now = time.time()
+    settled = []
+    ready = set()
+    for fname in list_seg_fnames(seed_seg_dir):
+        if fname in skip:
+            continue
+        inputs = get_watch_state(root_seg_dir, seed_seg_dir, fname, photos)
+        if inputs['root_seg'] is None or inputs['seed_seg'] is None:
+            continue
+        ready.add(fname)
+        if fname not in pending or pending[fname][0] != inputs:
+            pending[fname] = (inputs, now)
+        elif now - pending[fname][1] >= settle_seconds:
+            settled.append(fname)
+    for fname in set(pending) - ready:
+        del pending[fname]
+    return settled
+
+
+def watch_angles(root_seg_dir, im_dataset_dir, seed_seg_dir,
+                 max_seed_points_per_im, debug_image_dir,
+                 output_csv_path, error_csv_path,
+                 inner_radius=220, outer_radius=300,
+                 save_debug_image=True, roi_skeleton=True,
+                 cpus=os.cpu_count(), settle_seconds=5, poll_interval=1,
+                 idle_exit=None, progress_hook=None,
+                 cache_dir=None, cache_max_bytes=1024 ** 3,
+                 memory_budget=None, mmap_dir=None, sqlite_path=None):
+    """
+    Extract angles from the seed segmentations in {seed_seg_dir} as they
+    appear, until interrupted (Ctrl+C) or nothing new has arrived for
+    {idle_exit} seconds and no files are waiting to settle.
+
+    The directories are checked every {poll_interval} seconds. A file is
+    processed once its seed and root segmentations (and its photo, with
+    {save_debug_image}) have not changed for {settle_seconds}. The worker
+    pool is kept running between files and the rows for each file are
+    appended to angles.csv, errors.csv and timings.csv as soon as it completes.
+    Files already completed in the output folder (see extract_angles
+    with resume=True) are skipped, so watching can be stopped and started.
+    Files that change after they are processed are not processed again,
+    except for files that failed (i.e a missing photo) which are processed
+    again when their inputs (or photo) change.
+    The cache is evicted every CACHE_EVICT_INTERVAL seconds as files
+    complete, rather than only at the end.
+    The other arguments are the same as for extract_angles.
+    progress_hook(completed, total) is called as each file completes,
+    where total is the number of files found so far.
+    Returns a list of error messages.
+    """
+    if not os.path.isdir(debug_image_dir):
+        os.makedirs(debug_image_dir)
+
+    params = get_run_params(max_seed_points_per_im, inner_radius, outer_radius,
+                            save_debug_image, roi_skeleton)
+    manifest = Manifest(os.path.dirname(output_csv_path), params, resume=True)
+    done = set(f for f in list_seg_fnames(seed_seg_dir)
+               if manifest.is_done(f, get_input_state(root_seg_dir, seed_seg_dir, f)))
+    if done:
+        print('Resuming,', len(done), 'files already complete', file=sys.stderr)
+
+    cache = open_cache(cache_dir, cache_max_bytes)
+
+    pending = {}
+    # state of the files being processed (see get_watch_state).
+    submitted = {}
+    # state of the files that failed. They are tried again when it changes.
+    failed = {}
+    errors = []
+    last_scan = 0
+    last_activity = time.time()
+    last_evict = time.time()
+    timings_csv_path = get_timings_csv_path(output_csv_path)
+    with ExitStack() as stack:
+        database = None
+        if sqlite_path is not None:
+            # sqlite3 is only imported when it is used, so workers do not load it.
+            from results_db import SqliteResultSink # pylint: disable=C0415
+            database = stack.enter_context(SqliteResultSink(
+                sqlite_path, params, get_run_dirs(root_seg_dir, seed_seg_dir,
+                                                  im_dataset_dir, output_csv_path),
+                flush_interval=0))
+        sink = stack.enter_context(CsvResultSink(
+            output_csv_path, error_csv_path, flush_interval=0, manifest=manifest,
+            keep_files=done, timings_csv_path=timings_csv_path, in_place=True))
+        try:
+            with sys_utils.StreamingPool(
+                    extract_task,
+                    repeat_args=[root_seg_dir, im_dataset_dir, seed_seg_dir,
+                                 max_seed_points_per_im, inner_radius, outer_radius,
+                                 debug_image_dir, save_debug_image],
+                    repeat_kwargs={'roi_skeleton': roi_skeleton, 'cache': cache,
+                                   'mmap_dir': mmap_dir},
+                    cpus=cpus, memory_budget=memory_budget) as pool:
+                while True:
+                    if time.time() - last_scan >= poll_interval:
+                        last_scan = time.time()
+                        # the photo is only needed for the debug images.
+                        photos = None
+                        if save_debug_image and os.path.isdir(im_dataset_dir):
+                            photos = PhotoIndex(im_dataset_dir)
+                        skip = done | submitted.keys() | set(
+                            f for f, state in failed.items()
+                            if get_watch_state(root_seg_dir, seed_seg_dir, f, photos) == state)
+                        for fname in get_settled_fnames(root_seg_dir, seed_seg_dir, pending,
+                                                        settle_seconds, skip, photos):
+                            memory = 0
+                            if memory_budget is not None:
+                                memory = estimate_task_memory(
+                                    os.path.join(root_seg_dir, fname),
+                                    os.path.join(seed_seg_dir, fname),
+                                    roi_skeleton, mmap_dir)
+                            if pool.full(memory):
+                                # the rest are submitted after the next scan.
+                                break
+                            submitted[fname] = pending.pop(fname)[0]
+                            # photos could be added while watching, so they
+                            # are found by the worker rather than a PhotoIndex.
+                            pool.submit((fname, None), memory)
+                            last_activity = time.time()
+                    try:
+                        (fname, _), (records, timings) = pool.next_completed(
+                            timeout=max(0, last_scan + poll_interval - time.time()))
+                    except queue.Empty:
+                        # files that are settling are not idle, even if
+                        # settle_seconds is longer than idle_exit.
+                        if (idle_exit is not None and not pool.in_flight and not pending and
+                                time.time() - last_activity > idle_exit):
+                            break
+                        continue
+                    inputs = submitted.pop(fname)
+                    if has_file_error(records):
+                        # not in the manifest, so it is also tried again next time.
+                        failed[fname] = inputs
+                        sink.write(records, None, timings)
+                    else:
+                        failed.pop(fname, None)
+                        done.add(fname)
+                        # the manifest has the same state as get_input_state.
+                        seg_inputs = {k: inputs[k] for k in ['root_seg', 'seed_seg']}
+                        sink.write(records, manifest.get_entry(fname, seg_inputs), timings)
+                    if database is not None:
+                        database.write(records, timings)
+                    errors += get_error_messages(records)
+                    last_activity = time.time()
+                    if cache is not None and last_activity - last_evict > CACHE_EVICT_INTERVAL:
+                        cache.evict()
+                        last_evict = last_activity
+                    if progress_hook is not None:
+                        completed = len(done) + len(failed)
+                        progress_hook(completed, completed + len(submitted) + len(pending))
+        except KeyboardInterrupt:
+            # the pool is terminated and files in progress are done next time.
+            print('Stopped watching', seed_seg_dir, file=sys.stderr)
+    manifest.close()
+    if cache is not None:
+        cache.evict()
+    return errors
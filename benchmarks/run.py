@@ -0,0 +1,129 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Benchmarks for each stage of the angle extraction on synthetic images.
+# Run from the repository root:
+# python -m benchmarks.run [--cases read_root_seg,get_angles] [--json results.json]
+#
+# Each case is timed {repeat} times on the same input and the best and
+# median times are reported. Peak memory is measured with tracemalloc
+# in a separate run, as tracing slows everything down.
+
+# pylint: disable=C0103 # Variable name "im" doesn't conform to snake_case
+
+import os
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+import statistics
+
+import numpy as np
+
+import extract
+from benchmarks.synthetic import write_dataset, add_dataset_args, get_dataset_kwargs
+
+
+def get_cases(root_seg_dir, seed_seg_dir, photo_dir, debug_dir, fname,
+              inner_radius=220, outer_radius=300):
+    """ dict of case name to a function that runs that case once """
+    seg_path = os.path.join(root_seg_dir, fname)
+    seed_path = os.path.join(seed_seg_dir, fname)
+    seg_im = extract.load_mask(seg_path)
+    seed_im = extract.load_mask(seed_path)
+    seed_points = extract.find_seed_points(seed_im, seg_im.shape, 2)
+    centroids = seed_points['centroids'].tolist()
+    skel = extract.read_root_seg(seg_im)
+    radius_pairs = [(i, o) for i in range(200, 300, 10)
+                    for o in range(260, 360, 10) if i < o]
+
+    def get_angles(save_debug_image):
+        return lambda: extract.get_angles_from_image(
+            root_seg_dir, photo_dir, seed_seg_dir, 2, inner_radius, outer_radius,
+            debug_dir, save_debug_image, fname)
+
+    return {
+        'load_mask': lambda: extract.load_mask(seg_path),
+        'load_seed_points': lambda: extract.find_seed_points(seed_im, seg_im.shape, 2),
+        'read_root_seg': lambda: extract.read_root_seg(seg_im),
+        'read_root_seg_roi': lambda: extract.read_root_seg_roi(seg_im, centroids,
+                                                               outer_radius),
+        'get_primary_root_angle': lambda: [
+            extract.get_primary_root_angle(c, inner_radius, outer_radius, skel)
+            for c in centroids],
+        'get_primary_root_angles': lambda: extract.get_primary_root_angles(
+            centroids, inner_radius, outer_radius, skel),
+        'get_sweep_angles': lambda: [extract.get_sweep_angles(c, radius_pairs, skel)
+                                     for c in centroids],
+        'get_angles': get_angles(False),
+        'get_angles_debug': get_angles(True)
+    }
+
+
+def run_case(func, repeat):
+    """ best and median seconds of {repeat} runs and peak traced memory in bytes """
+    func() # warm up caches and imports.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'best_s': min(times), 'median_s': statistics.median(times),
+            'peak_mb': peak / (1024 ** 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run',
+                                     description='Time each stage of angle extraction.')
+    parser.add_argument('--cases', help='Comma separated cases to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='Also write the results to this file')
+    add_dataset_args(parser)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root_seg_dir, seed_seg_dir, photo_dir = write_dataset(
+            tmp_dir, images=1, **get_dataset_kwargs(args))
+        fname = os.listdir(seed_seg_dir)[0]
+        debug_dir = os.path.join(tmp_dir, 'debug_images')
+        os.makedirs(debug_dir)
+        cases = get_cases(root_seg_dir, seed_seg_dir, photo_dir, debug_dir, fname)
+        names = args.cases.split(',') if args.cases else list(cases)
+        unknown = [n for n in names if n not in cases]
+        if unknown:
+            parser.error(f'unknown cases {unknown}, choose from {list(cases)}')
+
+        results = {}
+        print(f"{'case':<24}{'best (s)':>10}{'median (s)':>12}{'peak (MB)':>11}")
+        for name in names:
+            results[name] = run_case(cases[name], args.repeat)
+            r = results[name]
+            print(f"{name:<24}{r['best_s']:>10.4f}{r['median_s']:>12.4f}{r['peak_mb']:>11.1f}")
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'dataset': get_dataset_kwargs(args),
+                       'numpy': np.__version__,
+                       'results': results}, json_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
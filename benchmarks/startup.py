@@ -0,0 +1,136 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Import time of the command line interface, the GUI and a worker process.
+# Run from the repository root:
+# python -m benchmarks.startup [--targets cli,worker] [--json startup.json]
+#                              [--budget-ms 1000]
+#
+# Each target is imported in a new python process with -X importtime,
+# which is what a worker started with spawn (the default on macOS and
+# Windows) pays before it can start work. The best of {repeat} runs is
+# reported with the packages that took the longest to import.
+# The exit status is 1 if any target takes longer than its budget
+# (or fails to import), so it can be used as a check in CI.
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# code run for each target. A worker imports batch to run extract_task.
+# worker_compute also imports what the first task without debug images
+# needs, and worker_debug what a debug image needs.
+TARGETS = {
+    'cli': 'import cli',
+    'gui': 'import main',
+    'worker': 'import batch',
+    'worker_compute': ('import batch, skimage.measure, skimage.morphology, '
+                       'skimage.transform, scipy.ndimage'),
+    'worker_debug': 'import batch, debug_image; debug_image.get_font()'
+}
+
+# import time budget in ms for each target, about twice what they take
+# on a laptop so only a real regression (i.e a new eager import) fails.
+BUDGETS_MS = {
+    'cli': 1500,
+    'gui': 3000,
+    'worker': 1500,
+    'worker_compute': 2000,
+    'worker_debug': 2000
+}
+
+
+def parse_importtime(stderr):
+    """ list of (self microseconds, cumulative microseconds, indent, module)
+        from the -X importtime output in {stderr} """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        indent = len(name) - len(name.lstrip())
+        imports.append((int(self_us), int(cumulative_us), indent, name.strip()))
+    return imports
+
+
+def run_target(code, repeat):
+    """ best total import time in ms of {code} and the time in that run
+        for each package, i.e scipy for all the scipy modules """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                              cwd=root, capture_output=True, text=True, check=False)
+        if proc.returncode != 0:
+            return {'error': proc.stderr.strip().splitlines()[-1]}
+        imports = parse_importtime(proc.stderr)
+        # the cumulative times of the top level imports add up to the total.
+        top_indent = min(indent for _, _, indent, _ in imports)
+        total_ms = sum(c for _, c, indent, _ in imports if indent == top_indent) / 1000
+        if best is None or total_ms < best['total_ms']:
+            packages = {}
+            for self_us, _, _, name in imports:
+                package = name.split('.')[0]
+                packages[package] = packages.get(package, 0) + self_us / 1000
+            best = {'total_ms': total_ms,
+                    'packages': dict(sorted(packages.items(), key=lambda p: -p[1]))}
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.startup',
+                                     description='Time the imports of each entry point.')
+    parser.add_argument('--targets', help=f'Comma separated targets to run '
+                                          f'(default: all of {",".join(TARGETS)})')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--budget-ms', type=float,
+                        help='Import time budget in ms for every target '
+                             '(default: the budget of each target in BUDGETS_MS)')
+    args = parser.parse_args()
+    names = args.targets.split(',') if args.targets else list(TARGETS)
+    unknown = [n for n in names if n not in TARGETS]
+    if unknown:
+        parser.error(f'unknown targets {unknown}, choose from {list(TARGETS)}')
+
+    results = {}
+    failed = []
+    print(f"{'target':<16}{'import (ms)':>12}{'budget (ms)':>12}  slowest packages (ms)")
+    for name in names:
+        results[name] = run_target(TARGETS[name], args.repeat)
+        r = results[name]
+        r['budget_ms'] = args.budget_ms if args.budget_ms is not None else BUDGETS_MS[name]
+        if 'error' in r:
+            failed.append(name)
+            print(f"{name:<16}{'-':>12}{r['budget_ms']:>12.0f}  {r['error']}")
+            continue
+        if r['total_ms'] > r['budget_ms']:
+            failed.append(name)
+        slowest = ', '.join(f'{p} {ms:.0f}' for p, ms in list(r['packages'].items())[:5])
+        print(f"{name:<16}{r['total_ms']:>12.1f}{r['budget_ms']:>12.0f}  {slowest}")
+
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump({'python': sys.version, 'results': results}, json_file, indent=2)
+    if failed:
+        print('Over budget:', ', '.join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Deterministic synthetic seedling images for the benchmarks.
+# Seeds are discs near the top of the image with straight roots
+# growing down from them, plus small blobs of noise.
+# Usage (writes root_seg, seed_seg and photos folders):
+# python -m benchmarks.synthetic output_dir --images 10
+
+# Variable name "im" doesn't conform to snake_case naming style (invalid-name)
+# pylint: disable=C0103
+# pylint: disable=R0913 # Too many arguments (too-many-arguments)
+
+import os
+import argparse
+
+import numpy as np
+from scipy import ndimage
+from skimage.draw import disk, line
+from PIL import Image
+
+
+def make_seedling(rng, height=1500, width=2000, seeds=2, roots_per_seed=3,
+                  root_width=7, noise_blobs=30, seed_radius=25):
+    """ bool root segmentation and seed segmentation of {height} x {width}
+        with {seeds} seeds, each with {roots_per_seed} roots """
+    root_im = np.zeros((height, width), dtype=bool)
+    seed_im = np.zeros((height, width), dtype=bool)
+    for i in range(seeds):
+        # seeds are spread across the top of the image.
+        cx = int((i + 0.5) * width / seeds + rng.integers(-width // 40, width // 40 + 1))
+        cy = int(height * 0.13 + rng.integers(-height // 40, height // 40 + 1))
+        rr, cc = disk((cy, cx), seed_radius, shape=seed_im.shape)
+        seed_im[rr, cc] = True
+        for angle in np.sort(rng.uniform(20, 160, roots_per_seed)):
+            length = height * 0.6
+            end_y = min(int(cy + length * np.sin(np.deg2rad(angle))), height - 1)
+            end_x = min(max(int(cx + length * np.cos(np.deg2rad(angle))), 0), width - 1)
+            rr, cc = line(cy, cx, end_y, end_x)
+            root_im[rr, cc] = True
+    for _ in range(noise_blobs):
+        rr, cc = disk((rng.integers(0, height), rng.integers(0, width)),
+                      rng.integers(2, 6), shape=root_im.shape)
+        root_im[rr, cc] = True
+    if root_width > 1:
+        root_im = ndimage.binary_dilation(
+            root_im, structure=np.ones((root_width, root_width), dtype=bool))
+    return root_im, seed_im
+
+
+def make_photo(rng, root_im):
+    """ RGB uint8 photo with the roots brighter than a noisy background """
+    photo = (rng.random(root_im.shape + (3,)) * 60).astype(np.uint8)
+    photo[root_im] = 200
+    return photo
+
+
+def to_rgba(im, color):
+    """ segmentation {im} as an RGBA image with the mask in the alpha channel,
+        as saved by RootPainter """
+    rgba = np.zeros(im.shape + (4,), dtype=np.uint8)
+    rgba[im] = color + (255,)
+    return Image.fromarray(rgba)
+
+
+def write_dataset(output_dir, images=10, seed_scale=4, random_seed=0, **kwargs):
+    """
+    Write {images} synthetic seedlings to the root_seg, seed_seg and photos
+    folders in {output_dir}. Seed segmentations are {seed_scale} times
+    smaller than the root segmentations and only cover the top of the
+    image, as the seed segmentation is assumed to be at the top.
+    The same {random_seed} always gives the same images.
+    Other arguments are passed to make_seedling.
+    Returns root_seg_dir, seed_seg_dir, photo_dir.
+    """
+    rng = np.random.default_rng(random_seed)
+    dirs = [os.path.join(output_dir, d) for d in ['root_seg', 'seed_seg', 'photos']]
+    for d in dirs:
+        os.makedirs(d, exist_ok=True)
+    root_seg_dir, seed_seg_dir, photo_dir = dirs
+    for i in range(images):
+        root_im, seed_im = make_seedling(rng, **kwargs)
+        fname = f'seedling_{i:04d}.png'
+        to_rgba(root_im, (255, 0, 0)).save(os.path.join(root_seg_dir, fname))
+        # only the top half of the seed segmentation, scaled down.
+        top = seed_im[:seed_im.shape[0] // 2]
+        small = Image.fromarray(top).resize((top.shape[1] // seed_scale,
+                                             top.shape[0] // seed_scale),
+                                            Image.Resampling.NEAREST)
+        to_rgba(np.array(small), (0, 255, 0)).save(os.path.join(seed_seg_dir, fname))
+        Image.fromarray(make_photo(rng, root_im)).save(
+            os.path.join(photo_dir, f'seedling_{i:04d}.jpg'), quality=90)
+    return root_seg_dir, seed_seg_dir, photo_dir
+
+
+def add_dataset_args(parser):
+    """ options for the size and content of the synthetic images """
+    parser.add_argument('--height', type=int, default=1500)
+    parser.add_argument('--width', type=int, default=2000)
+    parser.add_argument('--seeds', type=int, default=2, help='Seeds per image')
+    parser.add_argument('--roots-per-seed', type=int, default=3)
+    parser.add_argument('--root-width', type=int, default=7,
+                        help='Width of the roots in pixels')
+    parser.add_argument('--noise-blobs', type=int, default=30,
+                        help='Small blobs of noise per image, for root density')
+    parser.add_argument('--seed-scale', type=int, default=4,
+                        help='How many times smaller the seed segmentations are')
+    parser.add_argument('--random-seed', type=int, default=0)
+
+
+def get_dataset_kwargs(args):
+    return {'height': args.height, 'width': args.width, 'seeds': args.seeds,
+            'roots_per_seed': args.roots_per_seed, 'root_width': args.root_width,
+            'noise_blobs': args.noise_blobs, 'seed_scale': args.seed_scale,
+            'random_seed': args.random_seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.synthetic',
+                                     description='Write synthetic seedling images.')
+    parser.add_argument('output_dir')
+    parser.add_argument('--images', type=int, default=10)
+    add_dataset_args(parser)
+    args = parser.parse_args()
+    print(write_dataset(args.output_dir, args.images, **get_dataset_kwargs(args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# On disk cache of intermediate results (seed points and skeletons)
+# shared between runs. Entries are keyed by a hash of the content of
+# the input files and the parameters they depend on, so renaming or
+# touching a file does not invalidate them but changing it does.
+
+import os
+import sys
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+# change this when the cached results would be computed differently.
+CACHE_VERSION = 1
+
+
+def file_digest(path):
+    """ sha256 hex digest of the content of the file at {path} """
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Arrays stored as .npz files in {cache_dir}.
+
+    Workers load and save entries directly. Entries are written to a
+    temporary file and renamed, so a partly written entry is never read.
+    Loading an entry updates its modification time, and evict removes
+    the least recently used entries until the cache fits in max_bytes.
+    """
+    def __init__(self, cache_dir, max_bytes=1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, *parts):
+        """ cache key for a kind of entry and the digests and parameters it depends on """
+        return hashlib.sha256(json.dumps([CACHE_VERSION, *parts]).encode()).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def load(self, key):
+        """ dict of arrays stored for {key}, or None if there is no entry """
+        path = self.get_path(key)
+        try:
+            with np.load(path) as data:
+                entry = dict(data)
+        except (OSError, ValueError) as error:
+            # missing, or removed by evict while loading.
+            if os.path.isfile(path):
+                print('Could not load cache entry', path, error, file=sys.stderr)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def save(self, key, **arrays):
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.tmp',
+                                         delete=False) as tmp_file:
+            np.savez(tmp_file, **arrays)
+        os.replace(tmp_file.name, self.get_path(key))
+
+    def evict(self):
+        """ remove the least recently used entries until the
+            cache is no bigger than max_bytes """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.npz'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
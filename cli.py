@@ -0,0 +1,287 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Command line interface for extracting angles without the GUI.
+# Usage:
+# python -m cli root_seg_dir seed_seg_dir photo_dir output_dir [options]
+#
+# Progress and the final summary are printed to stdout as one JSON
+# object per line, i.e {"event": "progress", "completed": 3, "total": 10}
+# PyQt6 is never imported so this can run on machines without a display.
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+
+import batch
+
+
+def emit(event, **fields):
+    """ print a machine readable progress line """
+    print(json.dumps({'event': event, **fields}), flush=True)
+
+
+def create_output_folder(output_dir):
+    """ timestamped output folder, named the same way as the GUI """
+    current_time = time.strftime('%Y%m%d%H%M%S')
+    output_folder_path = os.path.join(output_dir,
+                                      f'{current_time}_extracted_root_angles')
+    os.makedirs(output_folder_path)
+    return output_folder_path
+
+
+def parse_radii(text):
+    """ radii from a comma separated list (220,240,260)
+        or a start:stop:step range, which includes stop (220:260:20) """
+    try:
+        if ':' in text:
+            start, stop, step = (int(v) for v in text.split(':'))
+            if step < 1:
+                raise ValueError
+            return list(range(start, stop + 1, step))
+        return [int(v) for v in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'expected a list like 220,240 or a range like 200:300:10, got {text}') from None
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog='python -m cli',
+        description='Extract seminal root angles from root and seed segmentations.')
+    parser.add_argument('root_seg_dir', help='Root segmentation directory')
+    parser.add_argument('seed_seg_dir', help='Seed segmentation directory')
+    parser.add_argument('photo_dir', help='Input photo directory')
+    parser.add_argument('output_dir',
+                        help='Directory in which a timestamped output folder is created '
+                             '(or the output folder of the run to resume with --resume)')
+    parser.add_argument('--max-seeds', type=int, default=2,
+                        help='Max seed points per image (default: 2)')
+    parser.add_argument('--inner-radius', type=int, default=220,
+                        help='Inner radius of root segment disk in pixels (default: 220)')
+    parser.add_argument('--outer-radius', type=int, default=300,
+                        help='Outer radius of root segment disk in pixels (default: 300)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of worker processes (default: all cpus)')
+    parser.add_argument('--debug-images', action='store_true',
+                        help='Output debug images (slower)')
+    parser.add_argument('--full-skeleton', action='store_true',
+                        help='Skeletonize the whole root segmentation instead of '
+                             'only the regions around the seed points (slower)')
+    parser.add_argument('--resume', action='store_true',
+                        help='Write to output_dir directly, skipping files already '
+                             'completed there by an earlier run with the same parameters')
+    parser.add_argument('--cache-dir',
+                        help='Directory to cache seed points and skeletons in, '
+                             'so later runs on the same files are faster')
+    parser.add_argument('--cache-size', type=int, default=1024,
+                        help='Max size of the cache in MB (default: 1024)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and extract angles from segmentations as they '
+                             'are added to seed_seg_dir, appending to the outputs in '
+                             'output_dir (which is used directly, as with --resume)')
+    parser.add_argument('--settle', type=float, default=5,
+                        help='With --watch, seconds a segmentation must be unchanged '
+                             'before it is processed (default: 5)')
+    parser.add_argument('--poll-interval', type=float, default=1,
+                        help='With --watch, seconds between checks for new files (default: 1)')
+    parser.add_argument('--idle-exit', type=float,
+                        help='With --watch, stop after this many seconds with no new files '
+                             '(default: run until interrupted)')
+    parser.add_argument('--columnar', choices=['parquet', 'feather'],
+                        help='Also write results.parquet or results.feather with typed '
+                             'columns for every seed, including the root centroids, '
+                             'radii, error codes and timings (needs pyarrow)')
+    parser.add_argument('--sqlite', metavar='PATH',
+                        help='Also add the run, its parameters and every result, error '
+                             'and timing to this SQLite database, which is created if '
+                             'needed and can hold many runs')
+    parser.add_argument('--memory-budget', type=int, metavar='MB',
+                        help='Only start images while their estimated memory use '
+                             'fits in this many MB, so large images run on fewer '
+                             'workers at once (default: no limit)')
+    parser.add_argument('--mmap-dir',
+                        help='Convert the root segmentations to memory mapped arrays in '
+                             'this directory and only read the regions around the seeds, '
+                             'for images too big to process in memory')
+    parser.add_argument('--sweep-inner', type=parse_radii, metavar='RADII',
+                        help='Inner radii to sweep, i.e 200:290:10 or 200,220. '
+                             'Used with --sweep-outer, every pair with inner < outer '
+                             'is written to sweep.csv instead of angles.csv')
+    parser.add_argument('--sweep-outer', type=parse_radii, metavar='RADII',
+                        help='Outer radii to sweep, i.e 260:350:10')
+    return parser
+
+
+def get_memory_budget(args):
+    if args.memory_budget is None:
+        return None
+    return args.memory_budget * 1024 ** 2
+
+
+def run_watch(args, output_folder):
+    """ watch the segmentation directories for the parsed {args} """
+    output_csv_path = os.path.join(output_folder, 'angles.csv')
+    error_csv_path = os.path.join(output_folder, 'errors.csv')
+    emit('watch', output_dir=output_folder, workers=args.workers)
+
+    def progress_hook(completed, total):
+        emit('progress', completed=completed, total=total)
+
+    start = time.time()
+    errors = batch.watch_angles(
+        args.root_seg_dir, args.photo_dir, args.seed_seg_dir,
+        args.max_seeds,
+        os.path.join(output_folder, 'debug_images'),
+        output_csv_path, error_csv_path,
+        inner_radius=args.inner_radius,
+        outer_radius=args.outer_radius,
+        save_debug_image=args.debug_images,
+        roi_skeleton=not args.full_skeleton,
+        cpus=args.workers,
+        settle_seconds=args.settle,
+        poll_interval=args.poll_interval,
+        idle_exit=args.idle_exit,
+        progress_hook=progress_hook,
+        cache_dir=args.cache_dir,
+        cache_max_bytes=args.cache_size * 1024 ** 2,
+        memory_budget=get_memory_budget(args),
+        mmap_dir=args.mmap_dir,
+        sqlite_path=args.sqlite)
+
+    emit('summary', errors=len(errors),
+         seconds=round(time.time() - start, 3),
+         output_dir=output_folder,
+         angles_csv=output_csv_path, errors_csv=error_csv_path)
+    return 0
+
+
+def run_sweep(args, output_folder):
+    """ radius sweep for the parsed {args}, written to sweep.csv """
+    radius_pairs = [(inner, outer) for inner in args.sweep_inner
+                    for outer in args.sweep_outer if inner < outer]
+    sweep_csv_path = os.path.join(output_folder, 'sweep.csv')
+    seg_fnames = batch.list_seg_fnames(args.seed_seg_dir)
+    emit('start', total=len(seg_fnames), output_dir=output_folder,
+         workers=args.workers, radius_pairs=len(radius_pairs))
+
+    def progress_hook(completed, total):
+        emit('progress', completed=completed, total=total)
+
+    start = time.time()
+    errors = batch.sweep_angles(
+        args.root_seg_dir, args.seed_seg_dir, args.max_seeds,
+        radius_pairs, sweep_csv_path,
+        roi_skeleton=not args.full_skeleton,
+        cpus=args.workers,
+        seg_fnames=seg_fnames,
+        progress_hook=progress_hook,
+        cache_dir=args.cache_dir,
+        cache_max_bytes=args.cache_size * 1024 ** 2,
+        memory_budget=get_memory_budget(args),
+        mmap_dir=args.mmap_dir)
+
+    emit('summary', images=len(seg_fnames), errors=len(errors),
+         radius_pairs=len(radius_pairs),
+         seconds=round(time.time() - start, 3),
+         output_dir=output_folder, sweep_csv=sweep_csv_path)
+    return 0
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+
+    if args.outer_radius <= args.inner_radius:
+        parser.error('outer radius must be bigger than inner radius')
+    if args.max_seeds < 1:
+        parser.error('max seeds must be at least 1')
+    if args.workers < 1:
+        parser.error('workers must be at least 1')
+    if args.memory_budget is not None and args.memory_budget < 1:
+        parser.error('memory budget must be at least 1 MB')
+    sweep = args.sweep_inner is not None or args.sweep_outer is not None
+    if sweep:
+        if args.sweep_inner is None or args.sweep_outer is None:
+            parser.error('--sweep-inner and --sweep-outer must be used together')
+        if not any(i < o for i in args.sweep_inner for o in args.sweep_outer):
+            parser.error('sweep has no radius pairs with inner radius < outer radius')
+        if args.resume or args.debug_images or args.watch:
+            parser.error('--resume, --watch and --debug-images can not be used with a sweep')
+    if args.columnar and (args.resume or args.watch or sweep):
+        parser.error('--columnar can not be used with --resume, --watch or a sweep')
+    if args.columnar and importlib.util.find_spec('pyarrow') is None:
+        parser.error('--columnar needs pyarrow, install it with pip install pyarrow')
+    if args.sqlite and sweep:
+        parser.error('--sqlite can not be used with a sweep')
+    if args.settle < 0 or args.poll_interval <= 0:
+        parser.error('settle must be at least 0 and poll interval more than 0 seconds')
+
+    if args.resume or args.watch:
+        output_folder = args.output_dir
+        os.makedirs(output_folder, exist_ok=True)
+    else:
+        output_folder = create_output_folder(args.output_dir)
+    if sweep:
+        return run_sweep(args, output_folder)
+    if args.watch:
+        return run_watch(args, output_folder)
+    output_csv_path = os.path.join(output_folder, 'angles.csv')
+    error_csv_path = os.path.join(output_folder, 'errors.csv')
+    columnar_path = None
+    if args.columnar:
+        columnar_path = os.path.join(output_folder, f'results.{args.columnar}')
+    seg_fnames = batch.list_seg_fnames(args.seed_seg_dir)
+    emit('start', total=len(seg_fnames), output_dir=output_folder,
+         workers=args.workers)
+
+    def progress_hook(completed, total):
+        emit('progress', completed=completed, total=total)
+
+    start = time.time()
+    errors = batch.extract_angles(
+        args.root_seg_dir, args.photo_dir, args.seed_seg_dir,
+        args.max_seeds,
+        os.path.join(output_folder, 'debug_images'),
+        output_csv_path, error_csv_path,
+        inner_radius=args.inner_radius,
+        outer_radius=args.outer_radius,
+        save_debug_image=args.debug_images,
+        roi_skeleton=not args.full_skeleton,
+        cpus=args.workers,
+        seg_fnames=seg_fnames,
+        progress_hook=progress_hook,
+        resume=args.resume,
+        cache_dir=args.cache_dir,
+        cache_max_bytes=args.cache_size * 1024 ** 2,
+        memory_budget=get_memory_budget(args),
+        mmap_dir=args.mmap_dir,
+        columnar_path=columnar_path,
+        sqlite_path=args.sqlite)
+
+    emit('summary', images=len(seg_fnames), errors=len(errors),
+         seconds=round(time.time() - start, 3),
+         output_dir=output_folder,
+         angles_csv=output_csv_path, errors_csv=error_csv_path,
+         columnar=columnar_path, sqlite=args.sqlite)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
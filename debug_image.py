@@ -0,0 +1,215 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Debug images show each step of the angle extraction for a seed point.
+# Everything is drawn on small uint8 panels, so the cost of a debug image
+# does not depend much on the size of the input images.
+
+# Variable name "im" doesn't conform to snake_case naming style (invalid-name)
+# pylint: disable=C0103
+# pylint: disable=R0913 # Too many arguments (too-many-arguments)
+# pylint: disable=R0902 # Too many instance attributes
+
+from functools import lru_cache
+
+import numpy as np
+from skimage.draw import line_aa
+from skimage.draw import circle_perimeter
+from PIL import Image, ImageFont, ImageDraw
+from timings import stage
+
+# width and height of each panel in the debug image.
+PANEL_SIZE = 640
+
+
+@lru_cache(maxsize=None)
+def get_font(size=42):
+    # matplotlib is only used to find a font, and is slow to import.
+    from matplotlib import font_manager # pylint: disable=C0415
+    font = font_manager.FontProperties(family='sans-serif', weight='bold')
+    fontfile = font_manager.findfont(font)
+    # use a truetype font
+    return ImageFont.truetype(fontfile, size)
+
+
+def get_tile(im):
+    """ 2D bool {im} scaled to PANEL_SIZE wide as uint8 (0-255).
+        Only the rows that will be shown in a panel are scaled. """
+    scale = PANEL_SIZE / im.shape[1]
+    rows = min(im.shape[0], int(np.ceil(PANEL_SIZE / scale)))
+    height = max(1, round(rows * scale))
+    tile = Image.fromarray(im[:rows]).convert('L')
+    return np.asarray(tile.resize((PANEL_SIZE, height), Image.Resampling.BOX))
+
+
+def paste(panel, tile, top=0, left=0):
+    """ paste {tile} into {panel} at top, left, clipped to the panel """
+    h = min(tile.shape[0], panel.shape[0] - top)
+    w = min(tile.shape[1], panel.shape[1] - left)
+    if h > 0 and w > 0:
+        if tile.ndim == 2:
+            tile = tile[:, :, None]
+        panel[top:top+h, left:left+w] = tile[:h, :w]
+
+
+def draw_half_circle(rgb_im, y, x, radius):
+    """ draw the bottom half of a circle in red, clipped to the image """
+    rr, cc = circle_perimeter(y, x, radius)
+    rr = np.maximum(rr, y) # semi circle will be used.
+    # make sure they are inside the image to avoid an error.
+    rr = np.clip(rr, 0, rgb_im.shape[0] - 1)
+    cc = np.clip(cc, 0, rgb_im.shape[1] - 1)
+    rgb_im[rr, cc] = (255, 0, 0)
+    return rgb_im
+
+
+def draw_line(img, y1, x1, y2, x2):
+    """ draw a straight line from x1,y1 to x2,y2 on img """
+    rr, cc, val = line_aa(round(y1), round(x1), round(y2), round(x2))
+    # full brightness for every pixel touched, so the lines are easy to see.
+    keep = (val > 0) & (rr >= 0) & (rr < img.shape[0]) & (cc >= 0) & (cc < img.shape[1])
+    img[rr[keep], cc[keep]] = 255
+    return img
+
+
+def add_text(image, text, x, y):
+    """
+    Example usage.
+    text_im = add_text(np.zeros((300, 300)),
+                       f'{70 + i}°', x=50, y=50)
+    """
+    img = Image.new("1", (image.shape[1], image.shape[0]), (0))
+    draw = ImageDraw.Draw(img)
+    draw.text((x, y), text, (1), font=get_font())
+    text_im = np.array(img)
+    image[text_im > 0] = 255
+    return image
+
+
+class DebugImage:
+    """
+    Debug image for the seed points of one image.
+
+    The top row shows the root segmentation, the seed, the skeleton
+    and the photo, scaled down to the panel width. The bottom row shows
+    the window around the seed point at each step of the angle extraction.
+
+    The scaled down images are made once and shared by all seed points,
+    and all seed points are drawn on the same canvas.
+    If timer (a timings.StageTimer) is given then the time spent
+    drawing is counted as debug_render.
+    """
+    def __init__(self, seg_im, skel, photo, inner_radius, outer_radius, timer=None):
+        self.shape = seg_im.shape
+        self.scale = PANEL_SIZE / seg_im.shape[1]
+        self.inner_radius = inner_radius
+        self.outer_radius = outer_radius
+        self.seg_tile = get_tile(seg_im)
+        # any skeleton pixel makes lines appear thicker and easier to see.
+        self.skel_tile = (get_tile(skel) > 0).astype(np.uint8) * 255
+        self.photo = photo
+        self.photo_tile = None
+        self.timer = timer
+        self.canvas = np.zeros((PANEL_SIZE * 2, PANEL_SIZE * 4, 3), dtype=np.uint8)
+        self.y = None
+        self.x = None
+
+    def panel(self, row, col):
+        return self.canvas[row*PANEL_SIZE:(row+1)*PANEL_SIZE,
+                           col*PANEL_SIZE:(col+1)*PANEL_SIZE]
+
+    def get_photo_tile(self):
+        if self.photo_tile is None:
+            with stage(self.timer, 'photo_lookup'):
+                self.photo.find_path()
+            with stage(self.timer, 'decode'):
+                tile = self.photo.load_thumbnail(PANEL_SIZE).astype(float)
+            tile *= 255 / max(np.max(tile), 1)
+            self.photo_tile = tile.astype(np.uint8)
+        return self.photo_tile
+
+    def start_seed(self, seed_centroid, seed_mask, seed_box):
+        """ clear the canvas and draw the top row for a seed point.
+            seed_mask is the mask of the seed inside seed_box (y0, y1, x0, x1) """
+        self.canvas[:] = 0
+        self.y = round(seed_centroid[0] * self.shape[0])
+        self.x = round(seed_centroid[1] * self.shape[1])
+        paste(self.panel(0, 0), self.seg_tile)
+
+        y0, _, x0, _ = seed_box
+        seed_tile = Image.fromarray(seed_mask).convert('L')
+        seed_tile = seed_tile.resize((max(1, round(seed_mask.shape[1] * self.scale)),
+                                      max(1, round(seed_mask.shape[0] * self.scale))),
+                                     Image.Resampling.BOX)
+        paste(self.panel(0, 1), np.asarray(seed_tile),
+              round(y0 * self.scale), round(x0 * self.scale))
+
+        panel = self.panel(0, 2)
+        paste(panel, self.skel_tile)
+        # add semi-circle to show location on skel
+        draw_half_circle(panel, round(self.y * self.scale), round(self.x * self.scale),
+                         round(self.outer_radius * self.scale))
+
+        # add circle to show location of extracted region
+        panel = self.panel(0, 3)
+        photo_tile = self.get_photo_tile()
+        paste(panel, photo_tile)
+        # inner_radius and outer_radius is specified relative to the segmentation.
+        # We rescale the coordinates to the photo, just in case the photo is somehow different
+        photo_scale = photo_tile.shape[0] / self.shape[0]
+        photo_y = round(seed_centroid[0] * photo_tile.shape[0])
+        photo_x = round(seed_centroid[1] * photo_tile.shape[1])
+        for radius in [self.inner_radius, self.outer_radius]:
+            draw_half_circle(panel, photo_y, photo_x, round(radius * photo_scale))
+
+    def get_window_offset(self, y0, x0):
+        """ position of image coordinate y0, x0 in the window around the seed point """
+        half = self.outer_radius + 20
+        return y0 - (self.y - half), x0 - (self.x - half)
+
+    def draw_window(self, col, local_im, y0, x0):
+        """ draw bool {local_im}, which starts at y0, x0 in the image,
+            in the window around the seed point """
+        with stage(self.timer, 'debug_render'):
+            top, left = self.get_window_offset(y0, x0)
+            paste(self.panel(1, col), local_im.astype(np.uint8) * 255, top, left)
+
+    def draw_points(self, col, points, radius=5):
+        """ draw a diamond at each (y, x) point in image coordinates """
+        with stage(self.timer, 'debug_render'):
+            panel = self.panel(1, col)
+            yy, xx = np.ogrid[-radius:radius+1, -radius:radius+1]
+            diamond = ((np.abs(yy) + np.abs(xx)) <= radius).astype(np.uint8) * 255
+            for y, x in points:
+                top, left = self.get_window_offset(round(y) - radius, round(x) - radius)
+                paste(panel[max(top, 0):, max(left, 0):],
+                      diamond[max(-top, 0):, max(-left, 0):])
+
+    def draw_angle(self, col, local_im, y0, x0, angle_degrees, points):
+        """ draw the skeleton with the angle and lines from the
+            seed point to each (y, x) root point """
+        with stage(self.timer, 'debug_render'):
+            self.draw_window(col, local_im, y0, x0)
+            panel = self.panel(1, col)
+            seed_y, seed_x = self.get_window_offset(self.y, self.x)
+            add_text(panel, f'{angle_degrees}°', x=seed_x, y=seed_y-60)
+            # draw line to indicate detected position of primary roots.
+            for y, x in points:
+                y, x = self.get_window_offset(y, x)
+                draw_line(panel[:, :, 0], y1=seed_y, x1=seed_x, y2=y, x2=x)
+
+    def save(self, path):
+        Image.fromarray(self.canvas).save(path, quality=95)
@@ -17,246 +17,491 @@ root segmentations already exist.
 # pylint: disable=R0915 # Too many statements (64/50) (too-many-statements)
 
 import os
+import sys
 import time
+import hashlib
 import datetime
+from functools import lru_cache
 
 import numpy as np
+from scipy import ndimage
 from skimage.measure import label, regionprops
-from skimage.morphology import skeletonize, remove_small_objects, binary_dilation
-from skimage.io import imread, imsave
-from skimage.draw import disk
-from skimage.draw import line_aa
-from skimage.draw import circle_perimeter
-from skimage.color import gray2rgb
+from skimage.morphology import skeletonize, remove_small_objects
 from skimage.transform import resize
-from skimage import img_as_ubyte
-from PIL import Image, ImageFont, ImageDraw
-import humanize
-from matplotlib import font_manager
-
-def save(impath, im):
-
-    im = im.astype(np.uint8)
-    # what a hassle. why do we have to do this crap?
-    new_p = Image.fromarray(im)
-    if new_p.mode != 'RGB':
-        new_p = new_p.convert('RGB')
-    imsave(impath, np.array(new_p))
-
-def load_seed_points(seg_im, max_seed_points):
-    """ extract seed point centroids for seed point segmentations """
-    # restrict to largest regions
+from PIL import Image
+from results import CsvResultSink, file_error_record, ERROR_TOO_FEW_ROOTS
+from cache import file_digest
+from timings import stage
+
+# extensions of the segmentation files (case insensitive).
+# .png segmentations store the mask in the alpha channel (or are 1-bit),
+# .npy files store the mask as a 2D array and .npz files store a
+# np.packbits packed mask as 'packed' along with its 'shape'.
+MASK_EXTENSIONS = ['.png', '.npy', '.npz']
+
+
+def is_mask_file(fname):
+    return os.path.splitext(fname)[1].lower() in MASK_EXTENSIONS
+
+
+def load_mask(path):
+    """ load the segmentation at {path} as a 2D bool array.
+        Only the mask is decoded into numpy, rather than all four
+        channels of an RGBA image. """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        mask = np.load(path)
+        if mask.dtype != bool:
+            mask = mask != 0
+        return mask
+    if ext == '.npz':
+        with np.load(path) as data:
+            shape = tuple(data['shape'])
+            bits = np.unpackbits(data['packed'], count=shape[0] * shape[1])
+        return bits.reshape(shape).view(bool)
+    with Image.open(path) as im:
+        if im.mode == '1':
+            return np.array(im)
+        if im.mode == 'P' and 'transparency' in im.info:
+            im = im.convert('RGBA')
+        if 'A' in im.getbands():
+            return np.asarray(im.getchannel('A')) != 0
+        if im.mode == 'L':
+            return np.asarray(im) != 0
+    raise Exception(f'Expected a mask in the alpha channel of {path} (mode {im.mode})')
+
+
+def get_mmap_path(path, mmap_dir):
+    """ path in {mmap_dir} of the .npy file load_mask_mmap converts {path} to """
+    # the same file name could be used in different datasets.
+    path_hash = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]
+    return os.path.join(mmap_dir, f'{path_hash}_{os.path.basename(path)}.npy')
+
+
+def is_mmap_current(path, mmap_dir):
+    """ True if load_mask_mmap can map the segmentation
+        at {path} without decoding (converting) it """
+    try:
+        if (os.path.splitext(path)[1].lower() == '.npy' and
+                np.load(path, mmap_mode='r').dtype == bool):
+            return True
+        npy_path = get_mmap_path(path, mmap_dir)
+        return os.stat(npy_path).st_mtime_ns == os.stat(path).st_mtime_ns
+    except (OSError, ValueError):
+        return False
+
+
+def load_mask_mmap(path, mmap_dir):
+    """ the segmentation at {path} as a read only memory mapped bool array,
+        so only the parts of it that are used are read into memory.
+        Segmentations that are not already .npy bool arrays are converted
+        to .npy files in {mmap_dir} the first time they are used, and
+        converted again if the segmentation is modified. """
+    if os.path.splitext(path)[1].lower() == '.npy':
+        mask = np.load(path, mmap_mode='r')
+        if mask.dtype == bool:
+            return mask
+    npy_path = get_mmap_path(path, mmap_dir)
+    mtime_ns = os.stat(path).st_mtime_ns
+    if not is_mmap_current(path, mmap_dir):
+        os.makedirs(mmap_dir, exist_ok=True)
+        mask = load_mask(path)
+        tmp_path = f'{npy_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as npy_file:
+            np.save(npy_file, mask)
+        # the modification time of the segmentation shows which version was converted.
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp_path, npy_path)
+    return np.load(npy_path, mmap_mode='r')
+
+
+def read_mask_shape(path):
+    """ (height, width) of the segmentation at {path},
+        read from the file header without decoding the mask """
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return np.load(path, mmap_mode='r').shape[:2]
+    if ext == '.npz':
+        with np.load(path) as data:
+            return tuple(data['shape'])
+    with Image.open(path) as im:
+        return im.height, im.width
+
+
+# Peak memory used to extract the angles from an image, per pixel of the
+# root segmentation, measured as the growth in max RSS for a 10000 x 8000
+# PNG with 2 seeds. Decoding the RGBA PNG is most of the 7.0 bytes per pixel
+# when only the regions around the seeds are skeletonized. Skeletonizing
+# the full image (roi_skeleton=False) measured 15.3 bytes per pixel.
+TASK_BYTES_PER_PIXEL = 8
+FULL_SKELETON_BYTES_PER_PIXEL = 16
+# When the root segmentation is already memory mapped (see load_mask_mmap)
+# it is not decoded, and the seed segmentation is most of the memory used.
+# This is per pixel of the seed segmentation, measured as 12 for a 2500 x 1000 PNG.
+SEED_BYTES_PER_PIXEL = 12
+
+
+def estimate_task_memory(seg_path, seed_path=None, roi_skeleton=True, mmap_dir=None):
+    """ estimated peak bytes used to extract the angles from the root
+        segmentation at {seg_path} and seed segmentation at {seed_path},
+        or 0 if they can not be read. roi_skeleton and mmap_dir are
+        as for load_seeds_and_skeleton. """
+    try:
+        if mmap_dir is not None and is_mmap_current(seg_path, mmap_dir):
+            if seed_path is None:
+                return 0
+            height, width = read_mask_shape(seed_path)
+            return int(height) * int(width) * SEED_BYTES_PER_PIXEL
+        height, width = read_mask_shape(seg_path)
+    except Exception:
+        return 0
+    if roi_skeleton:
+        return int(height) * int(width) * TASK_BYTES_PER_PIXEL
+    return int(height) * int(width) * FULL_SKELETON_BYTES_PER_PIXEL
+
+
+# extensions of the original photos (case insensitive)
+PHOTO_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.tiff']
+
+
+class LazyPhoto:
+    """
+    Handle to the original photo for the segmentation {fname}.
+    The photo is only located and decoded when load_thumbnail()
+    is called, which only happens when a debug image is saved.
+
+    If path or error are given (see PhotoIndex) then the
+    photo directory is not searched.
+    """
+    def __init__(self, im_dataset_dir, fname, path=None, error=None):
+        self.im_dataset_dir = im_dataset_dir
+        self.fname = fname
+        self.path = path
+        self.error = error
+
+    def find_path(self):
+        if self.error:
+            raise Exception(self.error)
+        if self.path:
+            return self.path
+        # we don't know what extension the original files have. Go through the common ones
+        stem = os.path.splitext(self.fname)[0]
+        for ext in PHOTO_EXTENSIONS:
+            for path_ext in [ext.upper(), ext]:
+                path = os.path.join(self.im_dataset_dir, stem + path_ext)
+                if os.path.isfile(path):
+                    self.path = path
+                    return path
+        raise Exception(f'Cound not find photo for {self.fname} in {self.im_dataset_dir}')
+
+    def load_thumbnail(self, width):
+        """ the photo scaled to {width} pixels wide.
+            JPEG photos are decoded at a reduced size where possible. """
+        with Image.open(self.find_path()) as im:
+            height = max(1, round(im.height * (width / im.width)))
+            im.draft('RGB', (width, height))
+            im = im.convert('RGB')
+            return np.asarray(im.resize((width, height)))
+
+
+class PhotoIndex:
+    """
+    Photos in {im_dataset_dir} by lower case file name (without extension).
+    The directory is listed once, so finding the photo for each
+    segmentation does not need any more file system requests.
+    """
+    def __init__(self, im_dataset_dir):
+        self.im_dataset_dir = im_dataset_dir
+        self.paths = {}
+        with os.scandir(im_dataset_dir) as entries:
+            for entry in entries:
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() in PHOTO_EXTENSIONS and entry.is_file():
+                    self.paths.setdefault(stem.lower(), []).append(entry.path)
+
+    def get_photo(self, fname):
+        """ LazyPhoto for the segmentation {fname}. Missing or ambiguous
+            photos only raise an error if the photo is used. """
+        paths = self.paths.get(os.path.splitext(fname)[0].lower(), [])
+        if len(paths) == 1:
+            return LazyPhoto(self.im_dataset_dir, fname, path=paths[0])
+        if paths:
+            names = ', '.join(sorted(os.path.basename(p) for p in paths))
+            error = f'Found more than one photo for {fname} in {self.im_dataset_dir}: {names}'
+        else:
+            error = f'Cound not find photo for {fname} in {self.im_dataset_dir}'
+        return LazyPhoto(self.im_dataset_dir, fname, error=error)
+
+
+def get_resize_map(size, new_size):
+    """ index in an axis of {size} pixels of each of the {new_size} pixels
+        it is resized to by skimage.transform.resize of a bool image """
+    return resize(np.arange(size)[:, None], (new_size, 1), order=0)[:, 0]
+
+
+def load_seed_points(seg_im, max_seed_points, shape=None, row_map=None, col_map=None):
+    """ extract seed point centroids for seed point segmentations.
+
+        Each seed is described by its label id in the returned label image
+        and its bounding box (y0, y1, x0, x1), rather than a full size mask.
+        The centroid is the middle of the top row of the seed,
+        relative to the image size (y, x).
+        shape is the size of the image if seg_im is only the top of it.
+        If seg_im is smaller than the image then row_map and col_map
+        (see get_resize_map) are the row and column of seg_im for each row
+        and column of the image. The seeds are labelled in seg_im and their
+        centroids, boxes and pixel counts are for seg_im resized to the image,
+        without making the resized copy. """
     label_img = label(seg_im)
-    def pixelcount(regionmask):
-        return np.sum(regionmask)
+    if shape is None:
+        shape = label_img.shape
+    if row_map is None:
+        row_map = np.arange(label_img.shape[0])
+    if col_map is None:
+        col_map = np.arange(label_img.shape[1])
+    # number of image rows and columns for each row and column of seg_im,
+    # and the first image row and sum of the image columns for each.
+    row_counts = np.bincount(row_map, minlength=label_img.shape[0])
+    col_counts = np.bincount(col_map, minlength=label_img.shape[1])
+    first_rows = np.searchsorted(row_map, np.arange(label_img.shape[0]))
+    col_sums = np.bincount(col_map, weights=np.arange(len(col_map)),
+                           minlength=label_img.shape[1])
+
+    flat_labels = label_img.ravel()
+    idx = np.flatnonzero(flat_labels)
+    labels = flat_labels[idx]
+    rows, cols = np.divmod(idx, label_img.shape[1])
+    # pixels that are not in the image (i.e below its bottom) are left out.
+    weights = row_counts[rows] * col_counts[cols]
+    keep = weights > 0
+    labels, rows, cols, weights = labels[keep], rows[keep], cols[keep], weights[keep]
+    counts = np.bincount(labels, weights=weights,
+                         minlength=label_img.max() + 1).astype(int)
+
+    # idx is in raster order, so the first pixel of each
+    # label is on the top row of that region.
+    label_ids, first_idx = np.unique(labels, return_index=True)
+    top_rows = np.zeros(counts.shape, dtype=rows.dtype)
+    top_rows[label_ids] = rows[first_idx]
+    at_top = rows == top_rows[labels]
+    # each pixel of the top row is col_counts[col] pixels of the image.
+    top_x = (np.bincount(labels[at_top], weights=col_sums[cols[at_top]],
+                         minlength=counts.size)
+             / np.maximum(np.bincount(labels[at_top], weights=col_counts[cols[at_top]],
+                                      minlength=counts.size), 1))
+    boxes = ndimage.find_objects(label_img)
 
-    props = regionprops(label_img, extra_properties=(pixelcount,))
     centroids = []
-    seed_masks = []
+    seeds = []
     pixel_counts = []
-    for prop in props:
-        if prop.pixelcount > 100:
-            # row, col
-            # y, x
-            ys = [c[0] for c in prop.coords]
-            xs = [c[1] for c in prop.coords]
-            min_y = np.min(ys)
-            xs_at_min_y = []
-            for x, y in zip(xs, ys):
-                if y == min_y:
-                    xs_at_min_y.append(x)
-            x = np.mean(xs_at_min_y)
-            y = min_y / label_img.shape[0]
-            x = x / label_img.shape[1]
-            centroids.append([y, x])
-            seed_mask = np.array(seg_im)
-            seed_mask[label_img != prop.label] = 0
-            seed_masks.append(seed_mask)
-            pixel_counts.append(prop.pixelcount)
+    # restrict to largest regions
+    for label_id in label_ids[counts[label_ids] > 100]:
+        # row, col
+        # y, x
+        y = first_rows[top_rows[label_id]] / shape[0]
+        x = top_x[label_id] / shape[1]
+        centroids.append([y, x])
+        box = boxes[label_id - 1]
+        # box of the image rows and columns for the box in seg_im.
+        y0, y1 = np.searchsorted(row_map, [box[0].start, box[0].stop])
+        x0, x1 = np.searchsorted(col_map, [box[1].start, box[1].stop])
+        seeds.append((label_id, (int(y0), int(y1), int(x0), int(x1))))
+        pixel_counts.append(counts[label_id])
     if len(pixel_counts) > 0:
-        pixel_counts, centroids, seed_masks = zip(*sorted(zip(pixel_counts,
-                                                              centroids,
-                                                              seed_masks),
-                                                          reverse=True))
+        pixel_counts, centroids, seeds = zip(*sorted(zip(pixel_counts,
+                                                         centroids,
+                                                         seeds),
+                                                     reverse=True))
     # limit to max_seed_points_per_im biggest (max)
     return (centroids[:max_seed_points],
-            seed_masks[:max_seed_points],
-            pixel_counts[:max_seed_points])
-
-
-def fix_first_row_im(debug_im):
-    new_w = 640
-    new_h = round(debug_im.shape[0] * (640 / debug_im.shape[1]))
-    _t = time.time()
-    assert np.max(debug_im) <= 1.0, 'expected float input'
-    debug_im = (debug_im * 255).astype(np.uint8)
-    debug_im = Image.fromarray(debug_im)
-    #debug_im = np.array(debug_im.resize((new_w, new_h), PIL.Image.NEAREST))
-    debug_im = np.array(debug_im.resize((new_w, new_h)))
-    #print('resize time', time.time() - t)
-    debug_im = debug_im[:640, :640]
-    # make sure debug im is at least 640        
-    zero_im = np.zeros((640, 640, 3))
-    zero_im[:debug_im.shape[0], :debug_im.shape[1]] = debug_im
-    debug_im = zero_im
-    return debug_im
-
-
-def get_merged_debug_im(debug_ims):
-    """ convert debug images to one image.
-        assumes first 4 could be any size and last 4
-        are 640x640x3 """
-    try:
-        to_add = 8 - len(debug_ims)
-        # add some empty images so this can still be used for incomplete i.e failed pipelines.
-        for _ in range(to_add):
-            debug_ims.append(np.zeros((640, 640, 3)))
-
-        if to_add > 0:
-            print('adding', to_add, 'debug_ims len is now', len(debug_ims))
-
-        def fixim(im):
-            im = im[:640, :640]
-            # make sure debug im is at least 640        
-            zero_im = np.zeros((640, 640, 3))
-            zero_im[:im.shape[0], :im.shape[1]] = im
-            zero_im = img_as_ubyte(zero_im)
-            return zero_im
-        
-        merge1 = np.hstack((debug_ims[0], debug_ims[1], debug_ims[2], debug_ims[3]))
-        merge2 = np.hstack((fixim(debug_ims[4]),fixim(debug_ims[5]),
-                            fixim(debug_ims[6]),fixim(debug_ims[7])))
-
-        merged = np.concatenate((merge1, merge2))
-        print('merged min', np.min(merged), 'max', np.max(merged), 'dtype', merged.dtype)
-
-        save('merged.png', merged)
-        return merged
-    except Exception as e:
-        print('Exception creating image', e)
-        raise e
+            seeds[:max_seed_points],
+            pixel_counts[:max_seed_points],
+            label_img)
+
+
+def find_seed_points(seed_im, seg_shape, max_seed_points, timer=None):
+    """ seed points of seed segmentation {seed_im}, for an image of {seg_shape}.
+        Returns a dict of arrays, which can be stored in the cache:
+        centroids (y, x), boxes (y0, y1, x0, x1), pixel_counts,
+        the shape of the image and mask_pixels, the mask of each
+        seed inside its box, flattened and concatenated.
+        timer is an optional timings.StageTimer. """
+    # seed im could be smaller.
+    # We assume the width of the seed im covers the full width of the image
+    # i.e seed_im.shape[1] (width) is a scaled down version of seg_im.shape[1]
+    # and the seed im is the top of the image.
+    # The seeds are found in the seed im and scaled to the image, which gives
+    # the same seeds as resizing the seed im to the width of the image.
+    with stage(timer, 'seed_resize'):
+        scale_coef = seg_shape[1] / seed_im.shape[1]
+        seed_im_new_height = round(seed_im.shape[0] * scale_coef)
+        if scale_coef < 1:
+            # scaling down can join or drop seeds, so the seed im is
+            # resized first, which is also smaller than the seed im.
+            seed_im = resize(seed_im, (seed_im_new_height, seg_shape[1]))
+            seed_im = seed_im[:seg_shape[0]].astype(bool)
+            row_map = np.arange(seed_im.shape[0])
+            col_map = np.arange(seed_im.shape[1])
+        else:
+            row_map = get_resize_map(seed_im.shape[0], seed_im_new_height)[:seg_shape[0]]
+            col_map = get_resize_map(seed_im.shape[1], seg_shape[1])
+            # rows below the bottom of the image have no seeds.
+            seed_im = seed_im[:row_map[-1] + 1] if len(row_map) else seed_im[:0]
+
+    with stage(timer, 'seed_detection'):
+        centroids, seeds, pixel_counts, label_img = load_seed_points(
+            seed_im, max_seed_points, seg_shape, row_map, col_map)
+        masks = []
+        for label_id, (y0, y1, x0, x1) in seeds:
+            # the seed resized to its box in the image.
+            masks.append(label_img[np.ix_(row_map[y0:y1], col_map[x0:x1])].ravel() == label_id)
+    return {'shape': np.array(seg_shape),
+            'centroids': np.array(centroids, dtype=float).reshape(-1, 2),
+            'boxes': np.array([box for _, box in seeds], dtype=int).reshape(-1, 4),
+            'pixel_counts': np.array(pixel_counts, dtype=int),
+            'mask_pixels': np.concatenate(masks + [np.zeros(0, dtype=bool)])}
+
+
+def get_seed_masks(seed_points):
+    """ mask of each seed inside its box, from find_seed_points """
+    masks = []
+    offset = 0
+    for y0, y1, x0, x1 in seed_points['boxes']:
+        size = (y1 - y0) * (x1 - x0)
+        masks.append(seed_points['mask_pixels'][offset:offset+size].reshape(y1 - y0, x1 - x0))
+        offset += size
+    return masks
+
+
+def get_seed_window(y, x, outer_radius, shape):
+    """ bounding box (y0, y1, x0, x1) of the half disk with {outer_radius}
+        below the seed point at y, x, clipped to an image of {shape} """
+    y0 = min(max(y, 0), shape[0] - 1)
+    y1 = min(y + outer_radius + 1, shape[0])
+    x0 = max(x - outer_radius, 0)
+    x1 = min(x + outer_radius + 1, shape[1])
+    return y0, y1, x0, x1
+
+
+@lru_cache(maxsize=None)
+def get_half_annulus(inner_radius, outer_radius):
+    """ boolean stencil of the bottom half of the annulus between
+        {inner_radius} and {outer_radius}, matching skimage.draw.disk.
+        The seed point is at row 0, column outer_radius.
+        Stencils are cached and shared so they are read only. """
+    yy, xx = np.ogrid[0:outer_radius + 1, -outer_radius:outer_radius + 1]
+    stencil = ((yy / outer_radius) ** 2 + (xx / outer_radius) ** 2) < 1
+    if inner_radius > 0:
+        stencil &= ((yy / inner_radius) ** 2 + (xx / inner_radius) ** 2) >= 1
+    stencil.flags.writeable = False
+    return stencil
+
+
+def get_window_stencil(inner_radius, outer_radius, y, x, window):
+    """ part of the half annulus stencil for the seed at y, x
+        that is inside {window} (y0, y1, x0, x1) """
+    y0, y1, x0, x1 = window
+    top = y0 - y
+    left = x0 - (x - outer_radius)
+    stencil = get_half_annulus(inner_radius, outer_radius)
+    return stencil[top:top + (y1 - y0), left:left + (x1 - x0)]
+
+
+def get_angle_degrees(a, b, c):
+    """ angle at point b between points a and c, each (y, x),
+        in degrees rounded to 1 decimal place """
+    # get angle between the three points.
+    a = np.array([a[1], a[0]])
+    b = np.array([b[1], b[0]])
+    c = np.array([c[1], c[0]])
+    ba = a - b
+    bc = c - b
+    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
+    angle = np.arccos(cosine_angle)
 
-def get_primary_root_angle(seed_centroid, inner_radius, outer_radius,
-                           im, seg_im, seed_im, skel, save_debug_image):
-    """ get the primary root angle for the specific seed centroid
-        TODO: refactor this function. It's way too long.
-    """
+    # https://manivannan-ai.medium.com/find-the-angle-between-three-points-from-2d-using-python-348c513e2cd
+    return round(np.degrees(angle), 1)
 
-    # dont modify in place.. it gets messy so make a copy.
-    _t = time.time()
-    seg_im = np.array(seg_im)
-    seed_im = np.array(seed_im)
 
-    skel = np.array(skel)
-    im = np.array(im).astype(float)
-    im /= np.max(im)
-    mask = np.zeros(skel.shape)
+def label_points(points):
+    """ (n_regions, labels) of the 8-connected components of {points},
+        rows of (y, x) in raster order, or (group, y, x) sorted by group then
+        raster order, where points are only connected within their group.
+        The neighbours of each point are found by searching the sorted keys
+        of the points, so the cost depends on the number of points and not
+        the size of the image. Components are numbered in the order of
+        their first point, which is the same order as the labels from label().
+    """
+    # imported here as it is slow to import, so workers start sooner.
+    from scipy.sparse import coo_matrix # pylint: disable=C0415
+    from scipy.sparse.csgraph import connected_components # pylint: disable=C0415
+    points = np.asarray(points, dtype=np.int64)
+    if not len(points):
+        return 0, np.zeros(0, dtype=int)
+    coords = points - points.min(axis=0)
+    # room for the row below and a column either side of every point,
+    # so no neighbour key wraps onto another row or group.
+    coords[:, -1] += 1
+    sizes = coords.max(axis=0) + 1
+    sizes[-2] += 1
+    sizes[-1] += 1
+    keys = np.ravel_multi_index(tuple(coords.T), tuple(sizes))
+    edges_i = []
+    edges_j = []
+    for dy, dx in [(0, 1), (1, -1), (1, 0), (1, 1)]:
+        neighbour_keys = keys + dy * sizes[-1] + dx
+        found = np.minimum(np.searchsorted(keys, neighbour_keys), len(keys) - 1)
+        is_edge = keys[found] == neighbour_keys
+        edges_i.append(np.flatnonzero(is_edge))
+        edges_j.append(found[is_edge])
+    edges_i = np.concatenate(edges_i)
+    edges_j = np.concatenate(edges_j)
+    graph = coo_matrix((np.ones(len(edges_i), dtype=bool), (edges_i, edges_j)),
+                       shape=(len(points), len(points)))
+    return connected_components(graph, directed=False)
 
-    debug_ims = []
-    if save_debug_image:
-        debug_ims.append(fix_first_row_im(gray2rgb(seg_im)))
-        debug_ims.append(fix_first_row_im(gray2rgb(seed_im)))
 
-    y = round(seed_centroid[0] * seed_im.shape[0])
-    x = round(seed_centroid[1] * seed_im.shape[1])
+def get_primary_root_angle(seed_centroid, inner_radius, outer_radius,
+                           skel, debug=None):
+    """ get the primary root angle for the specific seed centroid.
+
+        Only the bounding box of the half annulus below the seed
+        is processed so the cost does not depend on the image size.
+        If debug (a DebugImage) is given then each step is drawn on it.
+        Returns angle_degrees, error, root_centroids where root_centroids
+        are the (y, x) image coordinates of the left and right root segments.
+    """
+    y = round(seed_centroid[0] * skel.shape[0])
+    x = round(seed_centroid[1] * skel.shape[1])
 
-    if save_debug_image:
-        rgbskel = gray2rgb(skel)
-        # add semi-circle to show location on skel
-        rr, cc  = circle_perimeter(y, x, outer_radius)
-        rr = [r if r > y else y for r in rr] # semi circle will be used.
-        # make sure they are inside the image to avoid an error.
-        rr = [min(max(r, 0), im.shape[0]-1) for r in rr]
-        cc = [min(max(c, 0), im.shape[1]-1) for c in cc]
-        rgbskel = rgbskel.astype(np.uint)
-        rgbskel[rr, cc, 0] = 1.0
-        rgbskel = fix_first_row_im(rgbskel)
-        rgbskel[rgbskel > 0] = 255 # makes lines appear thicker and easier to see.
-        debug_ims.append(rgbskel)
-
-        # add circle to show location of extracted region
-        im_y = round(seed_centroid[0] * im.shape[0])
-        im_x = round(seed_centroid[1] * im.shape[1])
-
-        # inner_radius and outer_radius is specified relative to the segmentation.
-        # We rescale the coordinates to the image, just in case the image is somehow different
-        im_outer_radius = round(outer_radius * (im.shape[0] / skel.shape[0]))
-        im_inner_radius = round(inner_radius * (im.shape[0] / skel.shape[0]))
-
-        rr, cc  = circle_perimeter(im_y, im_x, im_inner_radius)
-        rr = [r if r > im_y else im_y for r in rr] # semi circle will be used.
-        # make sure they are inside the image to avoid an error.
-        rr = [min(max(r, 0), im.shape[0]-1) for r in rr]
-        cc = [min(max(c, 0), im.shape[1]-1) for c in cc]
-
-        # create a red line image, so I can brighten it a bit by setting any pixel above 0 to max value.
-        red_line_im = np.zeros(im.shape)
-
-        red_line_im[rr, cc, 0] =  1.0
-        
-        rr, cc  = circle_perimeter(im_y, im_x, im_outer_radius)
-        rr = [r if r > im_y else im_y for r in rr] # semi circle will be used.
-        # make sure they are inside the image to avoid an error.
-        rr = [min(max(r, 0), im.shape[0]-1) for r in rr]
-        cc = [min(max(c, 0), im.shape[1]-1) for c in cc]
-
-        red_line_im[rr, cc, 0] =  1.0
-
-        red_im = fix_first_row_im(red_line_im)
-        im = fix_first_row_im(im)
-        im[red_im > 0] = 255
-        debug_ims.append(im)
-
-    # then take larger disk and set to 0 if outside
-    rr, cc = disk((y, x), inner_radius)
-    rr = [r if r > y else y for r in rr] # semi circle will be used.
-    # make sure values are inside the image.
-    rr = [min(max(r, 0), mask.shape[0]-1) for r in rr]
-    cc = [min(max(c, 0), mask.shape[1]-1) for c in cc]
-    mask[rr, cc] = 1
-
-    rr, cc = disk((y, x), outer_radius)
-    rr = [r if r > y else y for r in rr] # semi circle will be used.
-
-    # make sure values are inside the image.
-    rr = [min(max(r, 0), mask.shape[0]-1) for r in rr]
-    cc = [min(max(c, 0), mask.shape[1]-1) for c in cc]
-
-    mask[rr, cc] = 1
-    
-    skel[mask < 1] = 0
+    # everything after this point works on the bounding box of the
+    # half annulus below the seed point. y0, x0 is the offset of the
+    # box in the image.
+    window = get_seed_window(y, x, outer_radius, skel.shape)
+    y0, y1, x0, x1 = window
+    local_skel = skel[y0:y1, x0:x1]
 
-    y_start = max(0, y-(outer_radius+20))
+    if debug:
+        # skeleton inside the outer half disk
+        mask = get_window_stencil(0, outer_radius, y, x, window)
+        debug.draw_window(0, np.logical_and(local_skel, mask), y0, x0)
 
-    if save_debug_image:
-        debug_ims.append(gray2rgb(skel[y_start:y+(outer_radius+20),
-                                       x-(outer_radius+20):x+(outer_radius+20)]))
-
-    # hide inner circle (less than inner radius)
-    rr, cc = disk((y, x), inner_radius)
-    rr = [r if r > y else y for r in rr] # semi circle will be used.
-    # make sure values are inside the image.
-    rr = [min(max(r, 0), mask.shape[0]-1) for r in rr]
-    cc = [min(max(c, 0), mask.shape[1]-1) for c in cc]
-    mask[rr, cc] = 0
-    skel[mask < 1] = 0
+    # hide everything outside of the half annulus.
+    mask = get_window_stencil(inner_radius, outer_radius, y, x, window)
+    local_skel = np.logical_and(local_skel, mask)
 
-    if save_debug_image:
-        y_start = max(0, y-(outer_radius+20))
-        debug_ims.append(gray2rgb(skel[y_start:y+(outer_radius+20),
-                                       x-(outer_radius+20):x+(outer_radius+20)]))
+    if debug:
+        debug.draw_window(1, local_skel, y0, x0)
 
     # take the regions left.
     # get the ones with the min and max x values.
     smallest_x_region = None
     largest_x_region = None
-    label_img = label(skel)
+    label_img = label(local_skel)
     props = regionprops(label_img)
 
     if len(props) < 2:
-        if save_debug_image:
-            return None, get_merged_debug_im(debug_ims), 'could not find two roots in local region'
-        return None, None, 'could not find two roots in local region'
+        return None, 'could not find two roots in local region', None
 
     for region in props:
         if not smallest_x_region or (region.centroid[1] < smallest_x_region.centroid[1]):
@@ -264,152 +509,378 @@ def get_primary_root_angle(seed_centroid, inner_radius, outer_radius,
         if not largest_x_region or (region.centroid[1] > largest_x_region.centroid[1]):
             largest_x_region = region
 
-    if save_debug_image:
-        region_im = np.zeros(skel.shape)
-        region_im[round(smallest_x_region.centroid[0]), round(smallest_x_region.centroid[1])] = 1
-        region_im[round(largest_x_region.centroid[0]), round(largest_x_region.centroid[1])] = 1
-        region_im[round(y), round(x)] = 1
-        
-        region_im = binary_dilation(region_im)
-        region_im = binary_dilation(region_im)
-        region_im = binary_dilation(region_im)
-        region_im = binary_dilation(region_im)
-        region_im = binary_dilation(region_im)
-        y_start = max(0, y-(outer_radius+20))
-        debug_ims.append(gray2rgb(region_im[y_start:y+(outer_radius+20),
-                                            x-(outer_radius+20):x+(outer_radius+20)]))
+    # translate centroids from the box back to image coordinates.
+    smallest_x_centroid = (smallest_x_region.centroid[0] + y0,
+                           smallest_x_region.centroid[1] + x0)
+    largest_x_centroid = (largest_x_region.centroid[0] + y0,
+                          largest_x_region.centroid[1] + x0)
 
-    # get angle between the three points.
-    a = np.array([smallest_x_region.centroid[1], smallest_x_region.centroid[0]])
-    b = np.array([x, y])
-    c = np.array([largest_x_region.centroid[1], largest_x_region.centroid[0]])
-    ba = a - b
-    bc = c - b
-    cosine_angle = np.dot(ba, bc) / (np.linalg.norm(ba) * np.linalg.norm(bc))
-    angle = np.arccos(cosine_angle)
+    if debug:
+        debug.draw_points(2, [smallest_x_centroid, largest_x_centroid, (y, x)])
 
-    # https://manivannan-ai.medium.com/find-the-angle-between-three-points-from-2d-using-python-348c513e2cd
-    angle_degrees = round(np.degrees(angle), 1)
+    angle_degrees = get_angle_degrees(smallest_x_centroid, (y, x), largest_x_centroid)
 
-    if save_debug_image:
-        angle_im = add_text(skel, f'{angle_degrees}°', x=x, y=y-60)
-        angle_im = gray2rgb(angle_im)
-        # draw line to indicate detected position of primary roots.
-        angle_im[:, :, 0] = draw_line(angle_im[:, :, 0], y1=y, x1=x, y2=a[1], x2=a[0])
-        angle_im[:, :, 0] = draw_line(angle_im[:, :, 0], y1=y, x1=x, y2=c[1], x2=c[0])
-        debug_ims.append(angle_im[y_start:y+(outer_radius+20),
-                                  x-(outer_radius+20):x+(outer_radius+20)])
+    if debug:
+        debug.draw_angle(3, local_skel, y0, x0, angle_degrees,
+                         [smallest_x_centroid, largest_x_centroid])
 
-    if save_debug_image:
-        merged = get_merged_debug_im(debug_ims)
-    else:
-        merged = None
+    return angle_degrees, None, [smallest_x_centroid, largest_x_centroid]
 
-    return angle_degrees, merged, None
+
+def get_primary_root_angles(seed_centroids, inner_radius, outer_radius, skel):
+    """ get_primary_root_angle for every seed centroid in an image.
+
+        The skeleton pixels inside the half annulus of each seed are
+        collected into one list of points tagged with their seed, and
+        the connected components of all of them are found in one pass
+        of label_points with the seed as the group. The half annuli
+        of seeds that are close together can overlap, so a pixel can be
+        in the list once for each seed, and the components of each seed
+        are the same as labelling its half annulus on its own.
+        The cost depends on the number of pixels in the half annuli,
+        not the number of seeds times the image size.
+        Returns a list of (angle_degrees, error, root_centroids),
+        one for each seed.
+    """
+    height, width = skel.shape
+    seed_yx = []
+    windows = []
+    seed_points = []
+    for i, seed_centroid in enumerate(seed_centroids):
+        y = round(seed_centroid[0] * height)
+        x = round(seed_centroid[1] * width)
+        window = get_seed_window(y, x, outer_radius, skel.shape)
+        y0, y1, x0, x1 = window
+        # in raster order, like the pixels of each region from regionprops.
+        local_points = np.argwhere(np.logical_and(
+            skel[y0:y1, x0:x1], get_window_stencil(inner_radius, outer_radius, y, x, window)))
+        seed_points.append(np.column_stack([np.full(len(local_points), i), local_points]))
+        seed_yx.append((y, x))
+        windows.append(window)
+    # seed index, y and x relative to the window of the seed.
+    points = np.concatenate(seed_points) if seed_points else np.zeros((0, 3), dtype=int)
+    offsets = np.array([w[::2] for w in windows], dtype=int).reshape(-1, 2)
+    image_points = points[:, 1:] + offsets[points[:, 0]]
+    # in image coordinates, so the points of each seed are in raster order.
+    n_regions, labels = label_points(np.column_stack([points[:, 0], image_points]))
+    counts = np.bincount(labels, minlength=n_regions)
+    mean_x = np.bincount(labels, weights=points[:, 2], minlength=n_regions) / counts
+    region_seeds = np.zeros(n_regions, dtype=int)
+    region_seeds[labels] = points[:, 0]
+    regions = np.arange(n_regions)
+    regions_per_seed = np.bincount(region_seeds, minlength=len(seed_centroids))
+    # the first region of each seed sorted by x, then label, is the one with
+    # the smallest (or largest) x that the loop in get_primary_root_angle finds.
+    smallest = np.lexsort((regions, mean_x, region_seeds))
+    largest = np.lexsort((regions, -mean_x, region_seeds))
+    first = np.concatenate([[0], np.cumsum(regions_per_seed)[:-1]]).astype(int)
+    # points of each region, in raster order.
+    region_order = np.argsort(labels, kind='stable')
+    region_start = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(int)
+
+    def get_centroid(region, y0, x0):
+        start = region_start[region]
+        centroid = points[region_order[start:start + counts[region]], 1:].astype(float).mean(
+            axis=0)
+        return centroid[0] + y0, centroid[1] + x0
+
+    results = []
+    for i, ((y, x), (y0, _, x0, _)) in enumerate(zip(seed_yx, windows)):
+        if regions_per_seed[i] < 2:
+            results.append((None, 'could not find two roots in local region', None))
+            continue
+        smallest_x_centroid = get_centroid(smallest[first[i]], y0, x0)
+        largest_x_centroid = get_centroid(largest[first[i]], y0, x0)
+        results.append((get_angle_degrees(smallest_x_centroid, (y, x), largest_x_centroid),
+                        None, [smallest_x_centroid, largest_x_centroid]))
+    return results
+
+
+def get_sweep_angles(seed_centroid, radius_pairs, skel):
+    """ get_primary_root_angle for the seed centroid and every
+        (inner_radius, outer_radius) in {radius_pairs}.
+
+        The skeleton pixels in the window of the biggest outer radius
+        are found once. For each pair only the pixels inside the half
+        annulus are kept and their connected components are found with
+        label_points, rather than labelling the window for every pair.
+        Returns a list of (angle_degrees, error), one for each pair.
+    """
+    y = round(seed_centroid[0] * skel.shape[0])
+    x = round(seed_centroid[1] * skel.shape[1])
+    max_outer_radius = max(outer for _, outer in radius_pairs)
+    y0, y1, x0, x1 = get_seed_window(y, x, max_outer_radius, skel.shape)
+    # in raster order, like the pixels of each region from regionprops.
+    points = np.argwhere(skel[y0:y1, x0:x1])
+    yy = points[:, 0] + (y0 - y)
+    xx = points[:, 1] + (x0 - x)
+
+    results = []
+    for inner_radius, outer_radius in radius_pairs:
+        # same test as get_half_annulus, so the same pixels are kept.
+        keep = ((yy / outer_radius) ** 2 + (xx / outer_radius) ** 2) < 1
+        if inner_radius > 0:
+            keep &= ((yy / inner_radius) ** 2 + (xx / inner_radius) ** 2) >= 1
+        n_regions, labels = label_points(points[keep])
+        if n_regions < 2:
+            results.append((None, 'could not find two roots in local region'))
+            continue
+        # points relative to the window of this outer radius,
+        # so the centroids are computed as in get_primary_root_angle.
+        pair_y0, _, pair_x0, _ = get_seed_window(y, x, outer_radius, skel.shape)
+        kept_points = points[keep] + (y0 - pair_y0, x0 - pair_x0)
+        counts = np.bincount(labels)
+        mean_x = np.bincount(labels, weights=kept_points[:, 1]) / counts
+        # argmin and argmax take the first region if there is a tie,
+        # like the loop in get_primary_root_angle.
+        centroids = []
+        for region in [np.argmin(mean_x), np.argmax(mean_x)]:
+            centroid = kept_points[labels == region].astype(float).mean(axis=0)
+            centroids.append((centroid[0] + pair_y0, centroid[1] + pair_x0))
+        results.append((get_angle_degrees(centroids[0], (y, x), centroids[1]), None))
+    return results
 
 
 def read_root_seg(im):
     """ convert segmentation {im} to skeleton
         and remove segments smaller than 30 pixels """
+    if not im.flags.writeable:
+        # skeletonize can not take read only arrays, i.e from load_mask_mmap.
+        im = np.array(im)
     skel = skeletonize(im)
     skel = remove_small_objects(skel, 30, connectivity=skel.ndim)
     return skel
 
-def draw_line(img, y1, x1, y2, x2):
-    """ draw a straight line from x1,y1 to x2,y2 on img """
-    rr, cc, val = line_aa(round(y1), round(x1), round(y2), round(x2))
-    img[rr, cc] = val * 255
-    return img
 
-def add_text(image, text, x, y):
-    """
-    Example usage.
-    text_im = add_text(np.zeros((300, 300)),
-                       f'{70 + i}°', x=50, y=50)
-    """
-    img = Image.new("1", (image.shape[1], image.shape[0]), (0))
-    draw = ImageDraw.Draw(img)
+# Extra pixels skeletonized around each region of interest.
+# This must be more than the 30 pixels used by remove_small_objects
+# and more than half the width of the thickest root, so that
+# the skeleton inside the region is the same as for the full image.
+ROI_MARGIN = 100
+
+
+def get_roi_boxes(seed_centroids, outer_radius, shape, margin=ROI_MARGIN):
+    """ padded bounding boxes (y0, y1, x0, x1) of the half annulus below
+        each seed centroid. Overlapping boxes are merged. """
+    boxes = []
+    for seed_centroid in seed_centroids:
+        y = round(seed_centroid[0] * shape[0])
+        x = round(seed_centroid[1] * shape[1])
+        y0, y1, x0, x1 = get_seed_window(y, x, outer_radius, shape)
+        boxes.append((max(y0 - margin, 0), min(y1 + margin, shape[0]),
+                      max(x0 - margin, 0), min(x1 + margin, shape[1])))
+    merged = True
+    while merged:
+        merged = False
+        for i, a in enumerate(boxes):
+            for j in range(i + 1, len(boxes)):
+                b = boxes[j]
+                if a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), max(a[1], b[1]),
+                                min(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+
+def read_root_seg_roi(im, seed_centroids, outer_radius, margin=ROI_MARGIN):
+    """ skeleton of segmentation {im} computed only around the
+        half annulus below each seed centroid.
+        The skeleton is empty everywhere else. """
+    skel = np.zeros(im.shape, dtype=bool)
+    for y0, y1, x0, x1 in get_roi_boxes(seed_centroids, outer_radius,
+                                        im.shape, margin):
+        skel[y0:y1, x0:x1] = read_root_seg(im[y0:y1, x0:x1])
+    return skel
 
-    font = font_manager.FontProperties(family='sans-serif', weight='bold')
-    fontfile = font_manager.findfont(font)
-    # use a truetype font
-    font = ImageFont.truetype(fontfile, 42)
-    draw.text((x, y), text, (1), font=font)
-    text_im = np.array(img)
-    image[text_im > 0] = 1
-    return image
+def load_seeds_and_skeleton(seg_path, seed_path, max_seed_points,
+                            outer_radius, roi_skeleton=True, cache=None,
+                            timer=None, mmap_dir=None):
+    """ seed points (see find_seed_points) and skeleton for the
+        segmentations at {seg_path} and {seed_path}.
+        If roi_skeleton is True then only the regions around the seed
+        points are skeletonized, which is much faster for large images.
+        The skeleton can be used for any outer radius up to {outer_radius}.
+        If cache (a cache.ArtifactCache) is given then the seed points and
+        skeleton are loaded from it when the input files have not changed.
+        timer is an optional timings.StageTimer.
+        If mmap_dir is given then the root segmentation is memory mapped
+        (see load_mask_mmap), so with roi_skeleton only the regions
+        around the seed points are read.
+        Returns seed_points, skel, seg_im. seg_im is None if the root
+        segmentation did not need to be loaded. """
+    seg_im = None
+    seed_points = None
+    skel = None
+
+    def load_seg():
+        with stage(timer, 'decode'):
+            if mmap_dir is not None:
+                return load_mask_mmap(seg_path, mmap_dir)
+            return load_mask(seg_path)
+
+    if cache is not None:
+        with stage(timer, 'cache'):
+            seg_digest = file_digest(seg_path)
+            seed_digest = file_digest(seed_path)
+            seed_key = cache.key('seed_points', seg_digest, seed_digest,
+                                 max_seed_points)
+            if roi_skeleton:
+                skel_key = cache.key('roi_skeleton', seg_digest, seed_digest,
+                                     max_seed_points, ROI_MARGIN)
+            else:
+                skel_key = cache.key('skeleton', seg_digest)
+            seed_points = cache.load(seed_key)
+            cached_skel = cache.load(skel_key)
+            # a skeleton made for a bigger outer radius also covers this one.
+            if (seed_points is not None and cached_skel is not None and
+                    cached_skel['outer_radius'] >= outer_radius):
+                skel = np.zeros(seed_points['shape'], dtype=bool)
+                skel[tuple(cached_skel['points'].T)] = True
+
+    if seed_points is None:
+        seg_im = load_seg()
+        with stage(timer, 'decode'):
+            seed_im = load_mask(seed_path)
+        seed_points = find_seed_points(seed_im, seg_im.shape,
+                                       max_seed_points, timer)
+        if cache is not None:
+            with stage(timer, 'cache'):
+                cache.save(seed_key, **seed_points)
+
+    if skel is None:
+        if seg_im is None:
+            seg_im = load_seg()
+        with stage(timer, 'skeletonize'):
+            if roi_skeleton:
+                # only the skeleton below the seed points is used for the angles.
+                skel = read_root_seg_roi(seg_im, seed_points['centroids'].tolist(),
+                                         outer_radius)
+            else:
+                skel = read_root_seg(seg_im)
+        if cache is not None:
+            with stage(timer, 'cache'):
+                cache.save(skel_key, points=np.argwhere(skel).astype(np.int32),
+                           outer_radius=outer_radius if roi_skeleton else np.inf)
+
+    return seed_points, skel, seg_im
 
 
 def get_angles_from_image(seg_dataset_dir, im_dataset_dir, seed_seg_dir,
                           max_seed_points_per_im, inner_radius,
                           outer_radius, debug_image_dir, save_debug_image,
-                          output_csv_path,
-                          error_csv_path,
-                          fname):
+                          fname, photo=None, roi_skeleton=True, cache=None,
+                          timer=None, mmap_dir=None):
 
 
     """
     Extract angles from {fname} 
     and debug information to the debug_images folder.
+    photo is the LazyPhoto for {fname}. If it is not given then
+    {im_dataset_dir} is searched for it when it is needed.
+    roi_skeleton, cache and mmap_dir are used by load_seeds_and_skeleton.
+    If timer (a timings.StageTimer) is given then the time spent
+    in each stage is added to it.
+
+    Returns a list of records (dicts with the fields in results.py),
+    one per seed. Nothing is written to the output files here.
     """
-    im = None
-    # we don't know what extension the original files have. Go through the common ones
-    for ext in ['.JPG', '.JPEG', '.PNG', '.TIFF']:
-        path = os.path.join(im_dataset_dir, os.path.splitext(fname)[0] + ext)
-        if os.path.isfile(path):
-            im = imread(path)
-            break
-        path = os.path.join(im_dataset_dir, os.path.splitext(fname)[0] + ext.lower())
-        if os.path.isfile(path):
-            im = imread(path)
-            break
-    if im is None:
-        raise Exception(f'Cound not find photo for {fname} in {im_dataset_dir}')
-    seg_im = imread(os.path.join(seg_dataset_dir, fname))[:, :, 3].astype(bool)
-
-    seed_im = imread(os.path.join(seed_seg_dir, fname))[:, :, 3].astype(bool)
-
-    ## change seed_im shape to be same size as seg_im. We assume its at the top of the image.
-
-    # seed im could be smaller.
-    # We assume the width of the seed im covers the full width of the image
-    # i.e seed_im.shape[1] (width) is a scaled down version of seg_im.shape[1]
-    scale_coef = seg_im.shape[1] / seed_im.shape[1]
-    seed_im_new_height = round(seed_im.shape[0] * scale_coef)
-    seed_im = resize(seed_im, (seed_im_new_height, seg_im.shape[1]))
-
-    new_seed_im = np.zeros(seg_im.shape)
-    # add seed im to the top of a blank image
-    new_seed_im[:seed_im.shape[0], :seed_im.shape[1]] = seed_im.astype(int)
-    seed_im = new_seed_im.astype(bool)
-    skel = read_root_seg(seg_im)
-
-    centroids, seed_masks, seed_pixels = load_seed_points(seed_im, max_seed_points_per_im)
-
-    error_fnames = []
-    errors = []
-    for i, (c, seed_mask, seed_size) in enumerate(zip(centroids, seed_masks, seed_pixels)):
-
-        angle_degrees, debug_image, error = get_primary_root_angle(c, inner_radius, outer_radius,
-                                                                   im, seg_im, seed_mask,
-                                                                   skel, save_debug_image)
-        if angle_degrees:
-            print(f"{fname},{angle_degrees},{i},{c[1]},{c[0]},{seed_size}",
-                  file=open(output_csv_path, 'a'))
+    # the photo is only needed for the debug image.
+    if photo is None:
+        photo = LazyPhoto(im_dataset_dir, fname)
+    seg_path = os.path.join(seg_dataset_dir, fname)
+    seed_points, skel, seg_im = load_seeds_and_skeleton(
+        seg_path, os.path.join(seed_seg_dir, fname),
+        max_seed_points_per_im, outer_radius, roi_skeleton, cache, timer, mmap_dir)
+    centroids = seed_points['centroids'].tolist()
+    seed_pixels = seed_points['pixel_counts'].tolist()
+    seed_boxes = seed_points['boxes'].tolist()
+
+    debug = None
+    seed_masks = None
+    if save_debug_image:
+        if seg_im is None:
+            with stage(timer, 'decode'):
+                if mmap_dir is not None:
+                    seg_im = load_mask_mmap(seg_path, mmap_dir)
+                else:
+                    seg_im = load_mask(seg_path)
+        with stage(timer, 'debug_render'):
+            # only imported for debug images, as it is slow to import.
+            from debug_image import DebugImage # pylint: disable=C0415
+            debug = DebugImage(seg_im, skel, photo, inner_radius, outer_radius, timer)
+            seed_masks = get_seed_masks(seed_points)
+
+    if debug:
+        # the angle for each seed is found as it is drawn, below.
+        angles = None
+    else:
+        # all seeds at once, as there is nothing to draw for each seed.
+        with stage(timer, 'angles'):
+            angles = get_primary_root_angles(centroids, inner_radius, outer_radius, skel)
+
+    records = []
+    for i, (c, seed_box, seed_size) in enumerate(zip(centroids, seed_boxes, seed_pixels)):
+        if debug:
+            with stage(timer, 'debug_render'):
+                debug.start_seed(c, seed_masks[i], seed_box)
+            with stage(timer, 'angles'):
+                angle_degrees, error, roots = get_primary_root_angle(c, inner_radius,
+                                                                     outer_radius, skel, debug)
+        else:
+            angle_degrees, error, roots = angles[i]
         if error:
-            print(f"'error:{fname},{error},{i}")
-            print(f"{fname},{error},{i},{c[1]},{c[0]},{seed_size}",
-                  file=open(error_csv_path, 'a'))
-            error_fnames.append(fname)
-            errors.append(error)
-
-        if debug_image is not None:
-            # strange rounding/precision error left something slightly larger than 1
-            # so we now restrict to max of 1.0
-            imsave(os.path.join(debug_image_dir,
-                                f"{fname.replace('.png', '')}_{i}.jpg"),
-                                debug_image.astype(np.uint8), quality=95)
-    return error_fnames, errors
+            print(f"'error:{fname},{error},{i}", file=sys.stderr)
+            # the only error for a seed is not finding two roots.
+            roots = [(None, None), (None, None)]
+        records.append({'file_name': fname, 'angle_degrees': angle_degrees,
+                        'error_message': error, 'seed_index': i,
+                        'seed_x': c[1], 'seed_y': c[0], 'seed_pixels': seed_size,
+                        'error_code': ERROR_TOO_FEW_ROOTS if error else None,
+                        'left_root_y': roots[0][0], 'left_root_x': roots[0][1],
+                        'right_root_y': roots[1][0], 'right_root_x': roots[1][1]})
+
+        if debug:
+            with stage(timer, 'debug_encode'):
+                debug.save(os.path.join(debug_image_dir,
+                                        f"{os.path.splitext(fname)[0]}_{i}.jpg"))
+    return records
+
+
+def get_sweep_angles_from_image(seg_dataset_dir, seed_seg_dir,
+                                max_seed_points_per_im, radius_pairs,
+                                fname, roi_skeleton=True, cache=None,
+                                mmap_dir=None):
+    """
+    Extract angles from {fname} for every (inner_radius, outer_radius)
+    in {radius_pairs}. The segmentations are loaded and skeletonized
+    once, for the biggest outer radius, and shared by all the pairs.
+
+    Returns a list of records (dicts with the fields in results.SWEEP_FIELDS),
+    one per radius pair and seed.
+    """
+    max_outer_radius = max(outer for _, outer in radius_pairs)
+    seed_points, skel, _ = load_seeds_and_skeleton(
+        os.path.join(seg_dataset_dir, fname), os.path.join(seed_seg_dir, fname),
+        max_seed_points_per_im, max_outer_radius, roi_skeleton, cache,
+        mmap_dir=mmap_dir)
+    centroids = seed_points['centroids'].tolist()
+    seed_pixels = seed_points['pixel_counts'].tolist()
+
+    records = []
+    for i, (c, seed_size) in enumerate(zip(centroids, seed_pixels)):
+        angles = get_sweep_angles(c, radius_pairs, skel)
+        for (inner_radius, outer_radius), (angle_degrees, error) in zip(radius_pairs, angles):
+            records.append({'file_name': fname, 'inner_radius': inner_radius,
+                            'outer_radius': outer_radius,
+                            'angle_degrees': angle_degrees,
+                            'error_message': error, 'seed_index': i,
+                            'seed_x': c[1], 'seed_y': c[0], 'seed_pixels': seed_size})
+    return records
+
 
 def extract_all_angles(root_seg_dir, im_dataset_dir,
                        seed_seg_dir, max_seed_points_per_im,
@@ -431,35 +902,28 @@ def extract_all_angles(root_seg_dir, im_dataset_dir,
     
     seg_fnames = os.listdir(seed_seg_dir)
     print('Seed segmentations', len(seg_fnames))
-    seg_fnames = [s for s in seg_fnames if '.png' in s]
+    seg_fnames = [s for s in seg_fnames if is_mask_file(s)]
 
     print('Extract all angles from', len(seg_fnames), 'seeg segmentations')
 
-    print("file_name,angle_degrees,seed_index,seed_x,seed_y,seed_pixels",
-          file=open(output_csv_path, 'w+'))
-
-    print("file_name,error_message,seed_index,seed_x,seed_y,seed_pixels",
-          file=open(error_csv_path, 'w+'))
     start = time.time()
-    for fname in seg_fnames:
-        print(f"Extracting angles:{seg_fnames.index(fname) + 1}/{len(seg_fnames)}", fname)
-        try:
-            get_angles_from_image(root_seg_dir, im_dataset_dir,
-                                  seed_seg_dir,
-                                  max_seed_points_per_im,
-                                  inner_radius,
-                                  outer_radius,
-                                  debug_image_dir,
-                                  save_debug_image=True,
-                                  output_csv_path=output_csv_path,
-                                  error_csv_path=error_csv_path,
-                                  fname=fname)
-
-        # csv_file, error_file,
-        except Exception as error:
-            print(fname, error)
-            print('file_name,{error},NA,NA,NA,NA', file=open(error_csv_path, 'a'))
-            raise error
-
+    with CsvResultSink(output_csv_path, error_csv_path) as sink:
+        for fname in seg_fnames:
+            print(f"Extracting angles:{seg_fnames.index(fname) + 1}/{len(seg_fnames)}", fname)
+            try:
+                sink.write(get_angles_from_image(root_seg_dir, im_dataset_dir,
+                                                 seed_seg_dir,
+                                                 max_seed_points_per_im,
+                                                 inner_radius,
+                                                 outer_radius,
+                                                 debug_image_dir,
+                                                 save_debug_image=True,
+                                                 fname=fname))
+            except Exception as error:
+                print(fname, error)
+                sink.write([file_error_record(fname, error)])
+                raise error
+
+    import humanize # pylint: disable=C0415
     time_str = humanize.naturaldelta(datetime.timedelta(seconds=time.time() - start))
     print('Extracting angles for', len(seg_fnames), 'images took', time_str)
@@ -1,7 +1,7 @@
 import sys
 import os
-import sys_utils
-from extract import get_angles_from_image
+from results import CsvResultSink
+from manifest import get_input_state
 from PyQt6.QtCore import Qt, QDateTime, pyqtSignal, QThread
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QGridLayout, QPushButton, 
@@ -29,6 +29,8 @@ class ProgressWatchThread(QThread):
     Runs another thread.
     """
     progress_change = pyqtSignal(int, int)
+    # event, file name (or None) and info, see batch.get_activity_hooks.
+    activity = pyqtSignal(str, object, dict)
     done = pyqtSignal(str, list)
 
     def __init__(self, root_seg_dir,
@@ -36,7 +38,7 @@ class ProgressWatchThread(QThread):
             max_seed_points_per_im, debug_image_dir,
             output_csv_path, error_csv_path,
             inner_radius=220, outer_radius=300,
-            output_debug_images=True):
+            output_debug_images=True, resume=False):
         super().__init__()
 
         self.root_seg_dir = root_seg_dir
@@ -49,69 +51,69 @@ class ProgressWatchThread(QThread):
         self.inner_radius = inner_radius
         self.outer_radius = outer_radius
         self.output_debug_images = output_debug_images
+        self.resume = resume
         self.multiprocess = True
 
     def run(self):
-        seg_fnames = os.listdir(self.seed_seg_dir)
-        seg_fnames = [s for s in seg_fnames if '.png' in s]
+        # imported here so the window is shown without waiting for
+        # numpy, scipy and skimage to load.
+        import batch # pylint: disable=C0415
+        seg_fnames = batch.list_seg_fnames(self.seed_seg_dir)
         start = time.time()
 
         # give progress update to show something is happening.
         print(f"Extracting angles:1/{len(seg_fnames)}")
         self.progress_change.emit(1, len(seg_fnames))
-
-        print("file_name,angle_degrees,seed_index,seed_x,seed_y,seed_pixels",
-              file=open(self.output_csv_path, 'w+'))
-
-        print("file_name,error_message,seed_index,seed_x,seed_y,seed_pixels",
-              file=open(self.error_csv_path, 'w+'))
         errors = []
 
-        def hook(step):
-            print(f"Extracting angles:{step + 1}/{len(seg_fnames)}")
-            self.progress_change.emit(step+1, len(seg_fnames))
+        def hook(completed, total):
+            print(f"Extracting angles:{completed}/{total}")
+            self.progress_change.emit(completed, total)
+
+        def activity_hook(event, fname, info):
+            # called from the thread reporting worker starts as well as this one.
+            self.activity.emit(event, fname, info)
 
         if self.multiprocess:
-            mp_results = sys_utils.multi_process(
-                func=get_angles_from_image,
-                repeat_args=[
-                    self.root_seg_dir, self.im_dataset_dir,
-                    self.seed_seg_dir, self.max_seed_points_per_im,
-                    self.inner_radius, 
-                    self.outer_radius, 
-                    self.debug_image_dir,
-                    self.output_debug_images,
-                    self.output_csv_path,
-                    self.error_csv_path
-                ],
-                fnames=seg_fnames,
-                progress_hook=hook)
-            errors = []
-            for m_fnames, m_errors in mp_results: # list of lists of errors
-                for f, e in zip(m_fnames, m_errors):
-                    errors.append(f'File: {f}, Error: {e}')
+            errors = batch.extract_angles(
+                self.root_seg_dir, self.im_dataset_dir,
+                self.seed_seg_dir, self.max_seed_points_per_im,
+                self.debug_image_dir,
+                self.output_csv_path,
+                self.error_csv_path,
+                inner_radius=self.inner_radius,
+                outer_radius=self.outer_radius,
+                save_debug_image=self.output_debug_images,
+                seg_fnames=seg_fnames,
+                progress_hook=hook,
+                resume=self.resume,
+                activity_hook=activity_hook)
         else:
             errors = []
-            for i, fname in enumerate(seg_fnames):
-                print(f"Extracting angles:{i + 1}/{len(seg_fnames)}", fname)
-                print(i+1, len(seg_fnames))
-                self.progress_change.emit(i+1, len(seg_fnames))
-                try:
-                    get_angles_from_image(self.root_seg_dir,
-                                          self.im_dataset_dir,
-                                          self.seed_seg_dir,
-                                          self.max_seed_points_per_im,
-                                          self.inner_radius,
-                                          self.outer_radius,
-                                          self.debug_image_dir,
-                                          self.output_debug_images,
-                                          self.output_csv_path,
-                                          self.error_csv_path,
-                                          fname)
-                except Exception as error:
-                    print(fname, error)
-                    print(f'{fname},{error},NA,NA,NA,NA', file=open(self.error_csv_path, 'a'))
-                    errors.append(error)
+            timings_csv_path = batch.get_timings_csv_path(self.output_csv_path)
+            inputs = {f: get_input_state(self.root_seg_dir, self.seed_seg_dir, f)
+                      for f in seg_fnames}
+            _, on_done = batch.get_activity_hooks(activity_hook,
+                                                  [(f, None) for f in seg_fnames], inputs)
+            with CsvResultSink(self.output_csv_path, self.error_csv_path,
+                               timings_csv_path=timings_csv_path) as sink:
+                for i, fname in enumerate(seg_fnames):
+                    print(f"Extracting angles:{i + 1}/{len(seg_fnames)}", fname)
+                    print(i+1, len(seg_fnames))
+                    self.progress_change.emit(i+1, len(seg_fnames))
+                    activity_hook('start', fname, {'pid': os.getpid(), 'time': time.time()})
+                    records, timings = batch.extract_file(self.root_seg_dir,
+                                                          self.im_dataset_dir,
+                                                          self.seed_seg_dir,
+                                                          self.max_seed_points_per_im,
+                                                          self.inner_radius,
+                                                          self.outer_radius,
+                                                          self.debug_image_dir,
+                                                          self.output_debug_images,
+                                                          fname)
+                    sink.write(records, timings=timings)
+                    on_done(fname, records, timings)
+                    errors += batch.get_error_messages(records)
         time_str = humanize.naturaldelta(datetime.timedelta(seconds=time.time() - start))
         print('Extracting angles for', len(seg_fnames), 'images took', time_str)
         self.done.emit(os.path.dirname(self.output_csv_path), errors)
@@ -127,9 +129,9 @@ class ProgressWidget(BaseProgressWidget):
             max_seed_points_per_im, debug_image_dir,
             output_csv_path, error_csv_path,
             inner_radius=220, outer_radius=300,
-            output_debug_images=True):
+            output_debug_images=True, resume=False):
 
-        os.makedirs(debug_image_dir)
+        os.makedirs(debug_image_dir, exist_ok=resume)
 
         self.progress_bar.setMaximum(len(ls(root_seg_dir)))
         print('Extracting angles from', len(ls(root_seg_dir)), 'files')
@@ -140,9 +142,11 @@ class ProgressWidget(BaseProgressWidget):
             output_csv_path, error_csv_path,
             inner_radius,
             outer_radius,
-            output_debug_images)
+            output_debug_images,
+            resume)
         
         self.watch_thread.progress_change.connect(self.onCountChanged)
+        self.watch_thread.activity.connect(self.onActivity)
         self.watch_thread.done.connect(self.done)
         self.watch_thread.start()
 
@@ -221,6 +225,14 @@ class SeminalRootAngleExtractor(QMainWindow):
         self.debug_image_checkbox.setCheckState(Qt.CheckState.Checked)
         self.layout.addWidget(self.debug_image_checkbox, 8, 1, 1, 3)
 
+        # add widget to resume an interrupted run
+        label = QLabel(f"Resume run in output directory:")
+        self.layout.addWidget(label, 9, 0, 1, 1, alignment=Qt.AlignmentFlag.AlignLeft)
+        self.resume_checkbox = QCheckBox()
+        self.resume_checkbox.setToolTip("Write to the selected output directory, skipping "
+                                        "files already completed there with the same settings")
+        self.layout.addWidget(self.resume_checkbox, 9, 1, 1, 3)
+
 
         # Create a folder selection button and label for the output directory
         self.create_output_dir_widgets("Output",
@@ -231,7 +243,7 @@ class SeminalRootAngleExtractor(QMainWindow):
         self.submit_button.clicked.connect(self.create_output_folder)
 
         #row: int, column: int, rowSpan: int, columnSpan: int, alignment: Qt.AlignmentFlag = Qt.Alignment()):
-        self.layout.addWidget(self.submit_button, 9, 0, 1, 4)
+        self.layout.addWidget(self.submit_button, 10, 0, 1, 4)
 
         self.root_seg_dir = ""
         self.seed_seg_dir = ""
@@ -327,6 +339,10 @@ class SeminalRootAngleExtractor(QMainWindow):
                 f"The following directories are missing:\n\n{', '.join(missing_directories)}",
                 QMessageBox.StandardButton.Ok
             )
+        elif self.resume_checkbox.checkState() == Qt.CheckState.Checked:
+            # the output directory is the folder of the run to resume.
+            print(f"Resuming in output folder: {self.output_dir}")
+            self.extract_angles(self.output_dir, resume=True)
         else:
             # Generate a folder name based on current time and 'extracted_root_angles'
             current_time = QDateTime.currentDateTime().toString("yyyyMMddhhmmss")
@@ -341,7 +357,7 @@ class SeminalRootAngleExtractor(QMainWindow):
             self.extract_angles(output_folder_path)
 
 
-    def extract_angles(self, output_folder):
+    def extract_angles(self, output_folder, resume=False):
         print('Extract angles')
 
 
@@ -360,7 +376,8 @@ class SeminalRootAngleExtractor(QMainWindow):
                                  debug_image_dir=os.path.join(output_folder, 'debug_images'),
                                  output_csv_path=os.path.join(output_folder, 'angles.csv'),
                                  error_csv_path=os.path.join(output_folder, 'errors.csv'),
-                                 output_debug_images=checked)
+                                 output_debug_images=checked,
+                                 resume=resume)
         self.progress_widget.show()
         self.close()
 
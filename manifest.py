@@ -0,0 +1,81 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# The manifest records which files are complete in an output folder,
+# so that an interrupted run can be resumed without repeating them.
+
+import os
+import json
+
+MANIFEST_NAME = 'manifest.jsonl'
+
+
+def get_input_state(root_seg_dir, seed_seg_dir, fname):
+    """ size and modification time of the segmentations for {fname},
+        used to detect inputs that changed since they were processed """
+    state = {}
+    for key, dir_path in [('root_seg', root_seg_dir), ('seed_seg', seed_seg_dir)]:
+        try:
+            stat = os.stat(os.path.join(dir_path, fname))
+            state[key] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            state[key] = None
+    return state
+
+
+class Manifest:
+    """
+    Completed files in {output_dir}, stored as one JSON object per line
+    with the file name, the state of its inputs and the parameters used.
+
+    Lines are only added after the records for those files have been
+    flushed to disk (see results.CsvResultSink), so every file in the
+    manifest has its results in the output folder.
+    If resume is False any existing manifest is replaced.
+    """
+    def __init__(self, output_dir, params, resume=False):
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self.params = params
+        self.entries = {}
+        if resume and os.path.isfile(self.path):
+            with open(self.path) as manifest_file:
+                for line in manifest_file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # last line could be incomplete if the run was killed.
+                        continue
+                    self.entries[entry['file_name']] = entry
+        self.file = open(self.path, 'a' if resume else 'w')
+
+    def is_done(self, fname, inputs):
+        """ True if {fname} was completed with the same inputs and parameters """
+        entry = self.entries.get(fname)
+        return (entry is not None and entry['inputs'] == inputs
+                and entry['params'] == self.params)
+
+    def get_entry(self, fname, inputs):
+        return {'file_name': fname, 'inputs': inputs, 'params': self.params}
+
+    def add(self, entries):
+        for entry in entries:
+            self.entries[entry['file_name']] = entry
+            print(json.dumps(entry), file=self.file)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
@@ -25,9 +25,16 @@ import time
 import sys
 import os
 import subprocess
-from PyQt6 import QtWidgets
+from collections import deque
+from PyQt6 import QtWidgets, QtCore
 from humanfriendly import format_timespan
 
+# images/s and seeds/s are for the files completed in the last {THROUGHPUT_WINDOW} seconds.
+THROUGHPUT_WINDOW = 30
+# shortest window the rates are measured over, so they are not
+# inflated by a tiny window just after the run starts.
+MIN_THROUGHPUT_WINDOW = 1
+
 
 class DoneMessageWindow(QtWidgets.QWidget):
     
@@ -80,6 +87,18 @@ class BaseProgressWidget(QtWidgets.QWidget):
         self.task = task
         self.start_time = None
         self.done_window = None
+        # activity of the workers, see onActivity.
+        self.run_start_time = None
+        self.total_bytes = 0
+        self.done_bytes = 0
+        # (time, seeds, bytes, cpu seconds, wall seconds) of each file completed recently.
+        self.completed_files = deque()
+        # pid to (fname, start time) of the file each worker is on, or None when idle.
+        self.workers = {}
+        self.file_workers = {}
+        # names of the files completed. Starts are reported by another thread,
+        # so the start of a file can arrive after it is done.
+        self.done_fnames = set()
         self.initUI()
 
     def get_seconds_remaining(self, processed_so_far, total):
@@ -100,8 +119,88 @@ class BaseProgressWidget(QtWidgets.QWidget):
         self.info_label = info_label
         self.progress_bar = QtWidgets.QProgressBar(self)
         self.layout.addWidget(self.progress_bar)
+        # throughput and worker state, shown once activity is reported.
+        self.activity_label = QtWidgets.QLabel()
+        self.activity_label.setVisible(False)
+        self.layout.addWidget(self.activity_label)
+        # the time each worker has been on its file changes without any events.
+        self.activity_timer = QtCore.QTimer(self)
+        self.activity_timer.timeout.connect(self.update_activity)
         self.setWindowTitle(self.task)
 
+    def onActivity(self, event, fname, info):
+        """ events from batch.get_activity_hooks """
+        now = time.time()
+        if event == 'run':
+            self.run_start_time = now
+            self.total_bytes = info['bytes']
+            self.activity_label.setVisible(True)
+            self.activity_timer.start(1000)
+        elif event == 'start':
+            if fname in self.done_fnames:
+                self.workers.setdefault(info['pid'], None)
+            else:
+                self.workers[info['pid']] = (fname, info['time'])
+                self.file_workers[fname] = info['pid']
+        elif event == 'done':
+            self.done_fnames.add(fname)
+            pid = self.file_workers.pop(fname, None)
+            if pid is not None and self.workers.get(pid, (None,))[0] == fname:
+                self.workers[pid] = None
+            self.done_bytes += info['bytes']
+            timings = info['timings']
+            self.completed_files.append((now, info['seeds'], info['bytes'],
+                                         timings['total_cpu_s'], timings['total_wall_s']))
+        self.update_activity()
+
+    def get_window_seconds(self):
+        """ length of the window the throughput is measured over so far """
+        now = time.time()
+        while self.completed_files and self.completed_files[0][0] < now - THROUGHPUT_WINDOW:
+            self.completed_files.popleft()
+        return max(now - max(self.run_start_time, now - THROUGHPUT_WINDOW),
+                   MIN_THROUGHPUT_WINDOW)
+
+    def get_bytes_seconds_remaining(self):
+        """ seconds remaining from the bytes processed recently,
+            or None if nothing has completed recently """
+        if self.run_start_time is None:
+            return None
+        seconds = self.get_window_seconds()
+        window_bytes = sum(f[2] for f in self.completed_files)
+        if not window_bytes:
+            return None
+        return (self.total_bytes - self.done_bytes) / (window_bytes / seconds)
+
+    def update_activity(self):
+        if self.run_start_time is None:
+            return
+        now = time.time()
+        seconds = self.get_window_seconds()
+        files = self.completed_files
+        lines = [f'Images/s: {len(files) / seconds:.2f}   '
+                 f'Seeds/s: {sum(f[1] for f in files) / seconds:.2f}   '
+                 f'(last {round(seconds)} s)']
+        wall = sum(f[4] for f in files)
+        if wall > 0:
+            # workers that are not using the cpu are waiting for the
+            # disk or for other processes on the machine.
+            cpu_percent = round(100 * sum(f[3] for f in files) / wall)
+            state = 'CPU bound' if cpu_percent >= 80 else 'waiting on I/O or other processes'
+            lines.append(f'Worker CPU use: {cpu_percent}% of file time ({state})')
+        busy = {pid: w for pid, w in self.workers.items() if w is not None}
+        lines.append(f'Workers: {len(busy)} busy, {len(self.workers) - len(busy)} idle')
+        for pid, worker in sorted(self.workers.items()):
+            if worker is None:
+                lines.append(f'    {pid}  idle')
+            else:
+                lines.append(f'    {pid}  {format_timespan(round(now - worker[1]))}  {worker[0]}')
+        if busy:
+            fname, start = min(busy.values(), key=lambda w: w[1])
+            lines.append(f'Slowest running file: {fname} '
+                         f'({format_timespan(round(now - start))})')
+        self.activity_label.setText('\n'.join(lines))
+
     def onCountChanged(self, value, total):
         # 'not self.start_time' because value could be greater than 2
         # (and self.start_time could be None, causing bugs)
@@ -114,7 +213,9 @@ class BaseProgressWidget(QtWidgets.QWidget):
                                     'Estimating time remaining..')
         else:
             # value-1 because start_time is once the first image has completed.
-            seconds_remaining = self.get_seconds_remaining(value-1, total)
+            seconds_remaining = self.get_bytes_seconds_remaining()
+            if seconds_remaining is None:
+                seconds_remaining = self.get_seconds_remaining(value-1, total)
             seconds_remaining = max(1, round(seconds_remaining))
             self.info_label.setText(f'{self.task} {value}/{total}. \n'
                                     'Estimated time remaining: '
@@ -122,6 +223,7 @@ class BaseProgressWidget(QtWidgets.QWidget):
         self.progress_bar.setValue(value)
 
     def done(self, output_dir, errors=None):
+        self.activity_timer.stop()
         self.done_window = DoneMessageWindow(self, self.task, output_dir, errors)
         self.done_window.show()
 
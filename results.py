@@ -0,0 +1,322 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Workers return one record (a dict) per seed rather than writing to
+# the output files themselves. Only the parent process writes the records.
+
+import os
+import csv
+import time
+
+from timings import TIMING_STAGES
+
+ANGLE_FIELDS = ['file_name', 'angle_degrees', 'seed_index',
+                'seed_x', 'seed_y', 'seed_pixels']
+
+ERROR_FIELDS = ['file_name', 'error_message', 'seed_index',
+                'seed_x', 'seed_y', 'seed_pixels']
+
+# long format table from a radius sweep, with one row per
+# file, radius pair and seed, including those with errors.
+SWEEP_FIELDS = ['file_name', 'inner_radius', 'outer_radius', 'angle_degrees',
+                'error_message', 'seed_index', 'seed_x', 'seed_y', 'seed_pixels']
+
+# one row per file with the wall and cpu seconds for each stage.
+TIMING_FIELDS = (['file_name', 'seeds', 'total_wall_s', 'total_cpu_s'] +
+                 [f'{s}_{t}_s' for s in TIMING_STAGES for t in ['wall', 'cpu']])
+
+
+# error codes in the columnar output, for the error messages.
+ERROR_TOO_FEW_ROOTS = 'too_few_roots'
+ERROR_FILE = 'file_error'
+
+# columns of the columnar output (see ColumnarResultSink) and their types,
+# followed by the timings for the file of each seed. The seed position is
+# relative to the image size (0 to 1, like seed_x and seed_y in angles.csv)
+# and the root segment centroids are in pixels, as named by _rel and _px.
+COLUMNAR_FIELDS = [('file_name', 'string'), ('seed_index', 'int32'),
+                   ('angle_degrees', 'float64'), ('seed_x_rel', 'float64'),
+                   ('seed_y_rel', 'float64'), ('seed_pixels', 'int64'),
+                   ('left_root_x_px', 'float64'), ('left_root_y_px', 'float64'),
+                   ('right_root_x_px', 'float64'), ('right_root_y_px', 'float64'),
+                   ('inner_radius', 'int32'), ('outer_radius', 'int32'),
+                   ('error_code', 'string'), ('error_message', 'string')]
+
+# record key of each columnar column that is named differently.
+COLUMNAR_RECORD_KEYS = {'seed_x_rel': 'seed_x', 'seed_y_rel': 'seed_y',
+                        'left_root_x_px': 'left_root_x', 'left_root_y_px': 'left_root_y',
+                        'right_root_x_px': 'right_root_x',
+                        'right_root_y_px': 'right_root_y'}
+
+
+def file_error_record(fname, error):
+    """ record for a file that failed before any seeds were found """
+    return {'file_name': fname, 'angle_degrees': None,
+            'error_message': str(error), 'seed_index': 'NA',
+            'seed_x': 'NA', 'seed_y': 'NA', 'seed_pixels': 'NA',
+            'error_code': ERROR_FILE,
+            'left_root_y': None, 'left_root_x': None,
+            'right_root_y': None, 'right_root_x': None}
+
+
+def read_kept_rows(path, keep_files):
+    """ rows (without the header) of the csv at {path}, or the partial file
+        left by an interrupted run, for the files in {keep_files} """
+    for existing in [path + '.partial', path]:
+        if os.path.isfile(existing):
+            with open(existing, newline='') as csv_file:
+                rows = list(csv.reader(csv_file))[1:]
+            return [r for r in rows if r and r[0] in keep_files]
+    return []
+
+
+def fsync_replace(file, path):
+    """ flush and fsync the open {file} then rename it to {path} """
+    file.flush()
+    os.fsync(file.fileno())
+    file.close()
+    os.replace(file.name, path)
+
+
+def open_csv(path, fields, kept_rows=(), in_place=False):
+    """ csv file and writer for {path}, starting with the header and {kept_rows}.
+        Rows are written to a temporary file next to {path}. If in_place
+        is True then rows are appended to {path} instead, so they can be
+        read while it is written.
+        The header and kept rows are fsync'd and renamed into place before
+        this returns, as the kept rows can be read from the file being
+        replaced and a run killed before its first flush must not lose them. """
+    out_path = path if in_place else path + '.partial'
+    start_file = open(out_path + '.tmp', 'w', newline='')
+    writer = csv.writer(start_file, lineterminator='\n')
+    writer.writerow(fields)
+    writer.writerows(kept_rows)
+    fsync_replace(start_file, out_path)
+    csv_file = open(out_path, 'a', newline='')
+    return csv_file, csv.writer(csv_file, lineterminator='\n')
+
+
+class CsvResultSink:
+    """
+    Writes records to angles.csv and errors.csv,
+    and the timings for each file to timings.csv if timings_csv_path is given.
+
+    Rows are buffered and written in batches to temporary files
+    next to the outputs, which are fsync'd and renamed into place
+    when the sink is closed. If in_place is True then rows are appended
+    to the outputs as they are written, which is used to watch a directory.
+
+    If a manifest is given then the entry for each file is added to it
+    once the rows for that file are on disk. If keep_files is given then
+    the rows for those files are kept from the existing outputs,
+    which is used to resume a run.
+    """
+    def __init__(self, output_csv_path, error_csv_path, batch_size=1000,
+                 flush_interval=5, manifest=None, keep_files=None,
+                 timings_csv_path=None, in_place=False):
+        self.output_csv_path = output_csv_path
+        self.error_csv_path = error_csv_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.manifest = manifest
+        self.timings_csv_path = timings_csv_path
+        self.in_place = in_place
+        self.buffer = []
+        self.timings_buffer = []
+        self.manifest_entries = []
+        self.last_flush = time.time()
+        kept_angles, kept_errors = [], []
+        if keep_files:
+            kept_angles = read_kept_rows(output_csv_path, keep_files)
+            kept_errors = read_kept_rows(error_csv_path, keep_files)
+        self.angle_file, self.angle_writer = open_csv(output_csv_path, ANGLE_FIELDS,
+                                                      kept_angles, in_place)
+        self.error_file, self.error_writer = open_csv(error_csv_path, ERROR_FIELDS,
+                                                      kept_errors, in_place)
+        self.timings_file = None
+        if timings_csv_path is not None:
+            kept_timings = []
+            if keep_files:
+                kept_timings = read_kept_rows(timings_csv_path, keep_files)
+            self.timings_file, self.timings_writer = open_csv(timings_csv_path, TIMING_FIELDS,
+                                                              kept_timings, in_place)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # keep whatever was completed, even if the run failed.
+        self.close()
+
+    def write(self, records, manifest_entry=None, timings=None):
+        """ add the records for a file. manifest_entry marks the file as
+            complete once the records are written. timings is the
+            timings record for the file (see timings.StageTimer) """
+        self.buffer += records
+        if timings is not None and self.timings_file is not None:
+            self.timings_buffer.append(timings)
+        if manifest_entry is not None:
+            self.manifest_entries.append(manifest_entry)
+        if (len(self.buffer) >= self.batch_size or
+                time.time() - self.last_flush > self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        for record in self.buffer:
+            if record['angle_degrees'] is not None:
+                self.angle_writer.writerow([record[f] for f in ANGLE_FIELDS])
+            if record['error_message']:
+                self.error_writer.writerow([record[f] for f in ERROR_FIELDS])
+        self.buffer = []
+        self.angle_file.flush()
+        self.error_file.flush()
+        if self.timings_file is not None:
+            self.timings_writer.writerows([[t[f] for f in TIMING_FIELDS]
+                                           for t in self.timings_buffer])
+            self.timings_file.flush()
+        self.timings_buffer = []
+        if self.manifest is not None and self.manifest_entries:
+            # the rows must be on disk before the files are marked complete.
+            for output_file in [self.angle_file, self.error_file, self.timings_file]:
+                if output_file is not None:
+                    os.fsync(output_file.fileno())
+            self.manifest.add(self.manifest_entries)
+        self.manifest_entries = []
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.angle_file.closed:
+            return
+        self.flush()
+        outputs = [(self.angle_file, self.output_csv_path),
+                   (self.error_file, self.error_csv_path),
+                   (self.timings_file, self.timings_csv_path)]
+        for output_file, path in outputs:
+            if output_file is None:
+                continue
+            if self.in_place:
+                output_file.flush()
+                os.fsync(output_file.fileno())
+                output_file.close()
+            else:
+                fsync_replace(output_file, path)
+
+
+class SweepCsvSink:
+    """
+    Writes records from a radius sweep to a single csv.
+    Like CsvResultSink, rows are buffered and written to a temporary
+    file which is renamed into place when the sink is closed.
+    """
+    def __init__(self, sweep_csv_path, batch_size=1000, flush_interval=5):
+        self.sweep_csv_path = sweep_csv_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.time()
+        self.sweep_file, self.writer = open_csv(sweep_csv_path, SWEEP_FIELDS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, records):
+        self.buffer += records
+        if (len(self.buffer) >= self.batch_size or
+                time.time() - self.last_flush > self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        # records for files that failed have no radius.
+        self.writer.writerows([[record.get(f, 'NA') for f in SWEEP_FIELDS]
+                               for record in self.buffer])
+        self.buffer = []
+        self.sweep_file.flush()
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.sweep_file.closed:
+            return
+        self.flush()
+        fsync_replace(self.sweep_file, self.sweep_csv_path)
+
+
+class ColumnarResultSink:
+    """
+    Writes records to a Parquet (.parquet) or Feather (.feather) file
+    with typed columns and one row per seed, including seeds with errors.
+    Each row also has the radii and the timings for its file.
+    Rows are written in batches to a temporary file next to {path},
+    which is renamed into place when the sink is closed.
+    This needs pyarrow, which is optional.
+    """
+    def __init__(self, path, inner_radius, outer_radius, batch_size=10000):
+        try:
+            import pyarrow # pylint: disable=C0415 # import-outside-toplevel
+        except ImportError as error:
+            raise ImportError('pyarrow is needed for Parquet or Feather output, '
+                              'install it with pip install pyarrow') from error
+        self.pa = pyarrow
+        self.path = path
+        self.radii = {'inner_radius': inner_radius, 'outer_radius': outer_radius}
+        self.batch_size = batch_size
+        self.buffer = []
+        fields = COLUMNAR_FIELDS + [('seeds', 'int32')] + [
+            (f, 'float64') for f in TIMING_FIELDS if f not in ['file_name', 'seeds']]
+        self.schema = pyarrow.schema([(name, getattr(pyarrow, dtype)())
+                                      for name, dtype in fields])
+        if path.endswith('.parquet'):
+            import pyarrow.parquet # pylint: disable=C0415
+            self.writer = pyarrow.parquet.ParquetWriter(path + '.partial', self.schema)
+        else:
+            import pyarrow.ipc # pylint: disable=C0415
+            # Feather files are Arrow IPC files.
+            self.writer = pyarrow.ipc.new_file(path + '.partial', self.schema)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, records, timings=None):
+        """ add the records for a file and the timings record for that file """
+        for record in records:
+            row = {**record, **self.radii, **(timings or {})}
+            values = {name: row.get(COLUMNAR_RECORD_KEYS.get(name, name))
+                      for name in self.schema.names}
+            # file errors have NA for the seed fields in the csv.
+            self.buffer.append({name: None if value == 'NA' else value
+                                for name, value in values.items()})
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.writer.write_table(self.pa.Table.from_pylist(self.buffer,
+                                                              schema=self.schema))
+        self.buffer = []
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.writer.close()
+        os.replace(self.path + '.partial', self.path)
+        self.closed = True
@@ -0,0 +1,180 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# SQLite database of results shared by many runs, so results can be
+# queried by file, run and parameters without reading the csv files.
+# i.e all angles for a plate over the last ten runs:
+#   SELECT r.run_id, r.file_name, r.seed_index, r.angle_degrees
+#   FROM results r WHERE r.file_name >= 'plate_x' AND r.file_name < 'plate_y'
+#   AND r.run_id IN (SELECT run_id FROM runs ORDER BY run_id DESC LIMIT 10)
+# File names are matched with a range rather than LIKE 'plate_x%', as LIKE is
+# case insensitive so it cannot use the file_name index (which is not).
+
+import json
+import time
+import sqlite3
+
+from results import TIMING_FIELDS
+
+RESULT_COLUMNS = ['file_name', 'seed_index', 'angle_degrees', 'seed_x', 'seed_y',
+                  'seed_pixels', 'left_root_x', 'left_root_y',
+                  'right_root_x', 'right_root_y']
+
+ERROR_COLUMNS = ['file_name', 'seed_index', 'seed_x', 'seed_y', 'seed_pixels',
+                 'error_code', 'error_message']
+
+TIMING_COLUMNS = TIMING_FIELDS
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS param_sets (
+    param_set_id INTEGER PRIMARY KEY,
+    params TEXT NOT NULL UNIQUE,
+    max_seed_points_per_im INTEGER,
+    inner_radius INTEGER,
+    outer_radius INTEGER,
+    roi_skeleton INTEGER,
+    save_debug_image INTEGER
+);
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    param_set_id INTEGER NOT NULL REFERENCES param_sets(param_set_id),
+    started TEXT NOT NULL,
+    finished TEXT,
+    root_seg_dir TEXT,
+    seed_seg_dir TEXT,
+    photo_dir TEXT,
+    output_dir TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    file_name TEXT NOT NULL,
+    seed_index INTEGER NOT NULL,
+    angle_degrees REAL NOT NULL,
+    seed_x REAL, seed_y REAL, seed_pixels INTEGER,
+    left_root_x REAL, left_root_y REAL, right_root_x REAL, right_root_y REAL
+);
+CREATE TABLE IF NOT EXISTS errors (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    file_name TEXT NOT NULL,
+    seed_index INTEGER,
+    seed_x REAL, seed_y REAL, seed_pixels INTEGER,
+    error_code TEXT,
+    error_message TEXT
+);
+CREATE TABLE IF NOT EXISTS timings (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    file_name TEXT NOT NULL,
+    seeds INTEGER,
+    {', '.join(f + ' REAL' for f in TIMING_COLUMNS[2:])}
+);
+CREATE INDEX IF NOT EXISTS results_file_name ON results(file_name);
+CREATE INDEX IF NOT EXISTS results_run_id ON results(run_id);
+CREATE INDEX IF NOT EXISTS errors_file_name ON errors(file_name);
+CREATE INDEX IF NOT EXISTS errors_run_id ON errors(run_id);
+CREATE INDEX IF NOT EXISTS timings_file_name ON timings(file_name);
+CREATE INDEX IF NOT EXISTS timings_run_id ON timings(run_id);
+CREATE INDEX IF NOT EXISTS runs_param_set_id ON runs(param_set_id);
+"""
+
+
+def now():
+    return time.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def insert_sql(table, columns):
+    return (f"INSERT INTO {table} (run_id, {', '.join(columns)}) "
+            f"VALUES (?, {', '.join('?' * len(columns))})")
+
+
+class SqliteResultSink:
+    """
+    Adds a run with its {params} and {dirs} (a dict with root_seg_dir,
+    seed_seg_dir, photo_dir and output_dir) to the database at {db_path},
+    then writes the records and timings for that run.
+
+    Rows are buffered and inserted in batches, each in one transaction.
+    Only the parent process writes to the database. WAL mode is used so
+    the database can be queried while a run is writing to it.
+    """
+    def __init__(self, db_path, params, dirs, batch_size=1000, flush_interval=5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.results = []
+        self.errors = []
+        self.timings = []
+        self.last_flush = time.time()
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+            params_json = json.dumps(params, sort_keys=True)
+            self.connection.execute(
+                'INSERT OR IGNORE INTO param_sets (params, max_seed_points_per_im, '
+                'inner_radius, outer_radius, roi_skeleton, save_debug_image) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (params_json, params.get('max_seed_points_per_im'),
+                 params.get('inner_radius'), params.get('outer_radius'),
+                 params.get('roi_skeleton'), params.get('save_debug_image')))
+            param_set_id = self.connection.execute(
+                'SELECT param_set_id FROM param_sets WHERE params = ?',
+                (params_json,)).fetchone()[0]
+            self.run_id = self.connection.execute(
+                'INSERT INTO runs (param_set_id, started, root_seg_dir, seed_seg_dir, '
+                'photo_dir, output_dir) VALUES (?, ?, ?, ?, ?, ?)',
+                (param_set_id, now(), dirs.get('root_seg_dir'), dirs.get('seed_seg_dir'),
+                 dirs.get('photo_dir'), dirs.get('output_dir'))).lastrowid
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, records, timings=None):
+        """ add the records for a file and the timings record for that file """
+        for record in records:
+            # file errors have NA for the seed fields in the csv.
+            values = {k: None if v == 'NA' else v for k, v in record.items()}
+            if record['angle_degrees'] is not None:
+                self.results.append([self.run_id] + [values[c] for c in RESULT_COLUMNS])
+            if record['error_message']:
+                self.errors.append([self.run_id] + [values[c] for c in ERROR_COLUMNS])
+        if timings is not None:
+            self.timings.append([self.run_id] + [timings[c] for c in TIMING_COLUMNS])
+        if (len(self.results) + len(self.errors) >= self.batch_size or
+                time.time() - self.last_flush > self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            self.connection.executemany(insert_sql('results', RESULT_COLUMNS), self.results)
+            self.connection.executemany(insert_sql('errors', ERROR_COLUMNS), self.errors)
+            self.connection.executemany(insert_sql('timings', TIMING_COLUMNS), self.timings)
+        self.results = []
+        self.errors = []
+        self.timings = []
+        self.last_flush = time.time()
+
+    def close(self):
+        if self.connection is None:
+            return
+        self.flush()
+        with self.connection:
+            self.connection.execute('UPDATE runs SET finished = ? WHERE run_id = ?',
+                                    (now(), self.run_id))
+        self.connection.close()
+        self.connection = None
@@ -17,35 +17,164 @@ along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import time
 import os
-from multiprocessing import Pool
+import queue
+import threading
+from multiprocessing import Pool, Queue
 
-def multi_process(func, repeat_args, fnames, 
-                  progress_hook=None, cpus=os.cpu_count()):
+# queue in each worker process for the start of each item, see StreamingPool.
+_started_queue = None
+
+
+def set_started_queue(started_queue):
+    """ Pool initializer for the workers of a StreamingPool with on_start """
+    global _started_queue # pylint: disable=W0603
+    _started_queue = started_queue
+
+
+def call_and_report_start(func, *args, **kwargs):
+    """ func(*args, **kwargs) in a worker, after reporting the
+        worker process id, the item (the last arg) and the time """
+    _started_queue.put((os.getpid(), args[-1], time.time()))
+    return func(*args, **kwargs)
+
+
+class StreamingPool:
+    """
+    Long lived pool of worker processes.
+    Items are submitted one at a time and func(*repeat_args, item)
+    results are collected in the order they complete, so a slow item
+    does not hold up the other workers.
+
+    If memory_budget (bytes) is given then each item is submitted with
+    an estimate of the memory it needs, and items are only admitted
+    while the total for the items in flight is within the budget.
+    An item is always admitted when nothing else is in flight,
+    so an item bigger than the budget runs on its own.
+
+    If on_start is given then on_start(pid, item, start_time) is called
+    when a worker process starts each item. It is called from a thread
+    in this process, as the workers report each start on a queue.
+    """
+    def __init__(self, func, repeat_args=(), repeat_kwargs=None,
+                 cpus=os.cpu_count(), max_in_flight=None, memory_budget=None,
+                 on_start=None):
+        self.func = func
+        self.repeat_args = list(repeat_args)
+        self.repeat_kwargs = repeat_kwargs or {}
+        # a few more tasks than workers keeps every worker busy
+        # while the parent is handling a completed result.
+        self.max_in_flight = max_in_flight or cpus * 2
+        self.in_flight = 0
+        self.memory_budget = memory_budget
+        self.in_flight_memory = 0
+        self.completed = queue.Queue()
+        self.started = None
+        self.started_thread = None
+        if on_start is None:
+            self.pool = Pool(cpus)
+        else:
+            self.started = Queue()
+            self.pool = Pool(cpus, initializer=set_started_queue, initargs=(self.started,))
+            self.started_thread = threading.Thread(target=self.report_starts,
+                                                   args=(on_start,), daemon=True)
+            self.started_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def full(self, memory=0):
+        """ True if no more items (that need {memory} bytes)
+            should be submitted until one completes """
+        if self.in_flight >= self.max_in_flight:
+            return True
+        return (self.memory_budget is not None and self.in_flight > 0 and
+                self.in_flight_memory + memory > self.memory_budget)
+
+    def submit(self, item, memory=0):
+        def callback(result):
+            self.completed.put((item, result, None, memory))
+
+        def error_callback(error):
+            self.completed.put((item, None, error, memory))
+
+        func, args = self.func, self.repeat_args + [item]
+        if self.started is not None:
+            func, args = call_and_report_start, [self.func] + args
+        self.pool.apply_async(func, args=args,
+                              kwds=self.repeat_kwargs,
+                              callback=callback,
+                              error_callback=error_callback)
+        self.in_flight += 1
+        self.in_flight_memory += memory
+
+    def next_completed(self, timeout=None):
+        """
+        Wait for the next item to complete and return (item, result).
+        Raises queue.Empty if nothing completes within {timeout} seconds
+        and re-raises any exception raised by func.
+        """
+        item, result, error, memory = self.completed.get(timeout=timeout)
+        self.in_flight -= 1
+        self.in_flight_memory -= memory
+        if error is not None:
+            raise error
+        return item, result
+
+    def report_starts(self, on_start):
+        while True:
+            started = self.started.get()
+            if started is None:
+                return
+            on_start(*started)
+
+    def stop_reporting_starts(self):
+        if self.started_thread is not None:
+            self.started.put(None)
+            self.started_thread.join()
+            self.started_thread = None
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.stop_reporting_starts()
+
+    def terminate(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.stop_reporting_starts()
+
+
+def stream_process(func, repeat_args, fnames, cpus=os.cpu_count(),
+                   repeat_kwargs=None, max_in_flight=None,
+                   memory_budget=None, estimate_memory=None, on_start=None):
     """
-    Use multiprocess pool to exec func.
-    repeat args are used every time.
-    A different f in fnames will be passed on
-    each execution of func
+    Run func(*repeat_args, fname, **repeat_kwargs) for each of {fnames}
+    on a StreamingPool of {cpus} processes and yield (fname, result)
+    for each as soon as it completes, in the order they complete.
+    If memory_budget is given then estimate_memory(fname) is the
+    bytes needed for fname, see StreamingPool, as is on_start.
     """
-    print('calling', func.__name__, 'on', len(fnames), 'images')
-    start = time.time()
-    
-    chunk_size = cpus
-    results = []
-
-    for i in range(0, len(fnames), chunk_size):
-        pool = Pool(chunk_size)
-        async_results = []
-        chunk = fnames[i:i+chunk_size]
-        for fname in chunk:
-            res = pool.apply_async(func, args=list(repeat_args) + [fname])
-            async_results.append(res)
-        pool.close()
-        pool.join()
-        for res in async_results:
-            results.append(res.get())
-        if progress_hook is not None:
-            progress_hook(i)
-
-    print(func.__name__, 'on', len(fnames), 'images took', time.time() - start)
-    return results
+    # no point starting more workers than there are files.
+    cpus = max(1, min(cpus, len(fnames)))
+    if memory_budget is not None:
+        # tasks waiting in the pool queue count towards the budget
+        # so there is no point queueing more than there are workers.
+        max_in_flight = max_in_flight or cpus
+    with StreamingPool(func, repeat_args, repeat_kwargs,
+                       cpus=cpus, max_in_flight=max_in_flight,
+                       memory_budget=memory_budget, on_start=on_start) as pool:
+        for fname in fnames:
+            memory = 0
+            if memory_budget is not None:
+                memory = estimate_memory(fname)
+            while pool.full(memory):
+                yield pool.next_completed()
+            pool.submit(fname, memory)
+        while pool.in_flight:
+            yield pool.next_completed()
@@ -0,0 +1,39 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Shared fixtures. Run the tests from the repository root:
+# python -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+# the modules are in the repository root, not a package.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.synthetic import write_dataset # pylint: disable=C0413
+
+# small images, so the radii used with them are small too.
+INNER_RADIUS = 40
+OUTER_RADIUS = 80
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """ root_seg_dir, seed_seg_dir, photo_dir of 3 small synthetic images """
+    return write_dataset(str(tmp_path / 'dataset'), images=3, height=400, width=600,
+                         noise_blobs=5)
@@ -0,0 +1,86 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# get_primary_root_angles and get_sweep_angles find the components of
+# many half annuli at once, and must give the same results as
+# get_primary_root_angle (which labels each half annulus on its own).
+
+import numpy as np
+import pytest
+from skimage.draw import line
+from skimage.morphology import skeletonize
+
+from extract import get_primary_root_angle, get_primary_root_angles, get_sweep_angles
+
+
+def random_skeleton(rng, height, width, lines):
+    """ random lines, thickened and skeletonized for half of the seeds
+        so both lines and skeletons with branches are tested """
+    im = np.zeros((height, width), dtype=bool)
+    for _ in range(lines):
+        rr, cc = line(int(rng.integers(0, height)), int(rng.integers(0, width)),
+                      int(rng.integers(0, height)), int(rng.integers(0, width)))
+        im[rr, cc] = True
+    if rng.random() < 0.5:
+        im = skeletonize(im | np.roll(im, 1, axis=0))
+    return im
+
+
+def random_seeds(rng, n, height, width):
+    """ relative seed centroids (like those from load_seed_points) with
+        seeds on the first and last rows and columns of the image and
+        seeds close together, so their half annuli overlap """
+    last_y, last_x = (height - 1) / height, (width - 1) / width
+    seeds = [(rng.integers(0, height) / height, rng.integers(0, width) / width)
+             for _ in range(n + 2)]
+    seeds += [(0.0, seeds[0][1]), (seeds[1][0], 0.0), (last_y, last_x), (seeds[0][0], last_x)]
+    y, x = seeds[0]
+    seeds += [(y, x), (min(y + 0.01, last_y), min(x + 0.02, last_x))]
+    return seeds
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_primary_root_angles_match_each_seed(seed):
+    rng = np.random.default_rng(seed)
+    height, width = rng.integers(60, 300, 2)
+    skel = random_skeleton(rng, height, width, rng.integers(0, 30))
+    seeds = random_seeds(rng, rng.integers(0, 5), height, width)
+    inner_radius = int(rng.integers(0, 30))
+    outer_radius = inner_radius + int(rng.integers(5, 60))
+    expected = [get_primary_root_angle(s, inner_radius, outer_radius, skel) for s in seeds]
+    assert get_primary_root_angles(seeds, inner_radius, outer_radius, skel) == expected
+
+
+def test_primary_root_angles_without_roots():
+    skel = np.zeros((100, 100), dtype=bool)
+    seeds = [(0.2, 0.5), (0.2, 0.55)]
+    results = get_primary_root_angles(seeds, 10, 40, skel)
+    assert results == [get_primary_root_angle(s, 10, 40, skel) for s in seeds]
+    assert all(angle is None and error for angle, error, _ in results)
+    assert not get_primary_root_angles([], 10, 40, skel)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_sweep_angles_match_each_pair(seed):
+    rng = np.random.default_rng(seed)
+    height, width = rng.integers(100, 400, 2)
+    skel = random_skeleton(rng, height, width, rng.integers(0, 30))
+    radius_pairs = [(inner, outer) for inner in range(0, 120, 23)
+                    for outer in range(20, 200, 31) if inner < outer]
+    for seed_centroid in random_seeds(rng, 1, height, width):
+        expected = [get_primary_root_angle(seed_centroid, inner, outer, skel)[:2]
+                    for inner, outer in radius_pairs]
+        assert get_sweep_angles(seed_centroid, radius_pairs, skel) == expected
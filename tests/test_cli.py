@@ -0,0 +1,53 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+from conftest import INNER_RADIUS, OUTER_RADIUS
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_stdout_is_json_lines_with_a_failing_file(dataset, tmp_path):
+    root_seg_dir, seed_seg_dir, photo_dir = dataset
+    # the photo is needed for the debug image, so this file fails.
+    os.remove(os.path.join(photo_dir, sorted(os.listdir(photo_dir))[0]))
+    proc = subprocess.run([sys.executable, '-m', 'cli', root_seg_dir, seed_seg_dir,
+                           photo_dir, str(tmp_path / 'output'), '--workers', '2',
+                           '--debug-images', '--inner-radius', str(INNER_RADIUS),
+                           '--outer-radius', str(OUTER_RADIUS)],
+                          cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+    events = [json.loads(line) for line in proc.stdout.splitlines()]
+    assert events[0]['event'] == 'start'
+    assert events[-1]['event'] == 'summary'
+    assert events[-1]['errors'] >= 1
+    assert 'Cound not find photo' in proc.stderr
+
+
+def test_photo_dir_is_not_needed_without_debug_images(dataset, tmp_path):
+    root_seg_dir, seed_seg_dir, _ = dataset
+    proc = subprocess.run([sys.executable, '-m', 'cli', root_seg_dir, seed_seg_dir,
+                           str(tmp_path / 'no_photos'), str(tmp_path / 'output'),
+                           '--workers', '2', '--inner-radius', str(INNER_RADIUS),
+                           '--outer-radius', str(OUTER_RADIUS)],
+                          cwd=ROOT_DIR, capture_output=True, text=True, check=True)
+    summary = json.loads(proc.stdout.splitlines()[-1])
+    assert summary['event'] == 'summary'
+    assert summary['images'] == 3
+    assert 'Traceback' not in proc.stderr and 'photo' not in proc.stderr
@@ -0,0 +1,104 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import csv
+import json
+import shutil
+import subprocess
+
+import batch
+from conftest import INNER_RADIUS, OUTER_RADIUS
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(dataset, output_dir, resume, progress_hook=None):
+    root_seg_dir, seed_seg_dir, photo_dir = dataset
+    return batch.extract_angles(root_seg_dir, photo_dir, seed_seg_dir, 2,
+                                os.path.join(output_dir, 'debug_images'),
+                                os.path.join(output_dir, 'angles.csv'),
+                                os.path.join(output_dir, 'errors.csv'),
+                                inner_radius=INNER_RADIUS, outer_radius=OUTER_RADIUS,
+                                save_debug_image=True, cpus=2, resume=resume,
+                                progress_hook=progress_hook)
+
+
+def read_fnames(path):
+    with open(path, newline='') as csv_file:
+        return set(row['file_name'] for row in csv.DictReader(csv_file))
+
+
+def read_rows(path):
+    with open(path, newline='') as csv_file:
+        return sorted(csv.reader(csv_file))
+
+
+def read_manifest_fnames(output_dir):
+    with open(os.path.join(output_dir, 'manifest.jsonl')) as manifest_file:
+        return [json.loads(line)['file_name'] for line in manifest_file
+                if 'file_name' in line]
+
+
+def test_failed_file_is_processed_again_on_resume(dataset, tmp_path):
+    photo_dir = dataset[2]
+    photo = sorted(os.listdir(photo_dir))[0]
+    fname = os.path.splitext(photo)[0] + '.png'
+    shutil.move(os.path.join(photo_dir, photo), tmp_path / photo)
+    output_dir = str(tmp_path / 'output')
+
+    errors = run(dataset, output_dir, resume=False)
+    assert [e for e in errors if 'Cound not find photo' in e] == [
+        f'File: {fname}, Error: Cound not find photo for {fname} in {photo_dir}']
+    completed = read_manifest_fnames(output_dir)
+    assert fname not in completed and len(completed) == 2
+    assert fname not in read_fnames(os.path.join(output_dir, 'angles.csv'))
+
+    shutil.move(tmp_path / photo, os.path.join(photo_dir, photo))
+    errors = run(dataset, output_dir, resume=True)
+    # only the failed file is processed again.
+    assert all(fname in e for e in errors)
+    assert not any('Cound not find photo' in e for e in errors)
+    assert fname in read_fnames(os.path.join(output_dir, 'angles.csv'))
+    assert os.path.isfile(os.path.join(output_dir, 'debug_images',
+                                       os.path.splitext(fname)[0] + '_0.jpg'))
+
+
+def test_kept_rows_survive_a_killed_resume(dataset, tmp_path):
+    output_dir = str(tmp_path / 'output')
+    run(dataset, output_dir, resume=False)
+    angles_csv_path = os.path.join(output_dir, 'angles.csv')
+    all_rows = read_rows(angles_csv_path)
+
+    # as if the first run was interrupted after one file.
+    manifest_path = os.path.join(output_dir, 'manifest.jsonl')
+    with open(manifest_path) as manifest_file:
+        first_entry = manifest_file.readline()
+    with open(manifest_path, 'w') as manifest_file:
+        manifest_file.write(first_entry)
+
+    # killed (without flushing anything) as soon as the next file completes.
+    code = (f'import os, conftest, test_resume; test_resume.run({tuple(dataset)!r}, {output_dir!r}, '
+            f'True, progress_hook=lambda completed, total: os._exit(3))')
+    proc = subprocess.run([sys.executable, '-c', code], cwd=TESTS_DIR, check=False,
+                          capture_output=True)
+    assert proc.returncode == 3, proc.stderr
+    assert read_manifest_fnames(output_dir) == [json.loads(first_entry)['file_name']]
+
+    run(dataset, output_dir, resume=True)
+    assert read_rows(angles_csv_path) == all_rows
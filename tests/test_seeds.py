@@ -0,0 +1,71 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# find_seed_points labels the seed segmentation at its own resolution.
+# The seed points must be the same as resizing it to the width of the
+# image first, so seed points in the cache from before stay valid.
+
+import numpy as np
+import pytest
+from skimage.draw import disk
+from skimage.transform import resize
+
+from extract import find_seed_points, load_seed_points
+
+
+def find_seed_points_resized(seed_im, seg_shape, max_seed_points):
+    """ find_seed_points by resizing {seed_im} to the image width first """
+    new_height = round(seed_im.shape[0] * seg_shape[1] / seed_im.shape[1])
+    seed_im = resize(seed_im, (new_height, seg_shape[1]))[:seg_shape[0]].astype(bool)
+    centroids, seeds, pixel_counts, label_img = load_seed_points(seed_im, max_seed_points,
+                                                                 seg_shape)
+    masks = [label_img[y0:y1, x0:x1].ravel() == label_id
+             for label_id, (y0, y1, x0, x1) in seeds]
+    return {'shape': np.array(seg_shape),
+            'centroids': np.array(centroids, dtype=float).reshape(-1, 2),
+            'boxes': np.array([box for _, box in seeds], dtype=int).reshape(-1, 4),
+            'pixel_counts': np.array(pixel_counts, dtype=int),
+            'mask_pixels': np.concatenate(masks + [np.zeros(0, dtype=bool)])}
+
+
+def random_seed_im(rng, height, width):
+    seed_im = np.zeros((height, width), dtype=bool)
+    for _ in range(rng.integers(0, 10)):
+        rr, cc = disk((rng.integers(0, height), rng.integers(0, width)),
+                      rng.integers(2, 15), shape=seed_im.shape)
+        seed_im[rr, cc] = True
+    return seed_im
+
+
+# (seed width, image width, image height relative to the resized seed im).
+# Scales below 1, 1, above 1 and not a whole number, and images that are
+# shorter than the resized seed segmentation, so its bottom is cut off.
+SCALES = [(300, 200, 3), (300, 211, 0.5), (200, 200, 2), (200, 200, 0.7),
+          (100, 300, 4), (100, 250, 2.5), (120, 370, 0.6), (90, 401, 0.3)]
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('seed_width, width, height_ratio', SCALES)
+def test_seed_points_match_resizing_first(seed, seed_width, width, height_ratio):
+    rng = np.random.default_rng(seed)
+    seed_im = random_seed_im(rng, int(rng.integers(40, 120)), seed_width)
+    resized_height = round(seed_im.shape[0] * width / seed_width)
+    seg_shape = (max(1, round(resized_height * height_ratio)), width)
+    expected = find_seed_points_resized(seed_im, seg_shape, 3)
+    seed_points = find_seed_points(seed_im, seg_shape, 3)
+    assert seed_points.keys() == expected.keys()
+    for key, value in expected.items():
+        assert np.array_equal(seed_points[key], value), key
@@ -0,0 +1,90 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import shutil
+
+import batch
+from conftest import INNER_RADIUS, OUTER_RADIUS
+from test_resume import read_fnames
+
+
+def test_file_is_processed_again_when_its_photo_arrives(dataset, tmp_path):
+    root_seg_dir, seed_seg_dir, photo_dir = dataset
+    photo = sorted(os.listdir(photo_dir))[0]
+    fname = os.path.splitext(photo)[0] + '.png'
+    shutil.move(os.path.join(photo_dir, photo), tmp_path / photo)
+    output_dir = tmp_path / 'output'
+    os.makedirs(output_dir)
+
+    def progress_hook(completed, _total):
+        # the photo arrives after every file has been processed once.
+        if completed == 3 and os.path.exists(tmp_path / photo):
+            shutil.move(tmp_path / photo, os.path.join(photo_dir, photo))
+
+    errors = batch.watch_angles(root_seg_dir, photo_dir, seed_seg_dir, 2,
+                                str(output_dir / 'debug_images'),
+                                str(output_dir / 'angles.csv'),
+                                str(output_dir / 'errors.csv'),
+                                inner_radius=INNER_RADIUS, outer_radius=OUTER_RADIUS,
+                                save_debug_image=True, cpus=1, settle_seconds=0,
+                                poll_interval=0.1, idle_exit=2,
+                                progress_hook=progress_hook)
+    assert any('Cound not find photo' in e for e in errors)
+    assert fname in read_fnames(output_dir / 'angles.csv')
+    assert os.path.isfile(output_dir / 'debug_images' / (os.path.splitext(fname)[0] + '_0.jpg'))
+    with open(output_dir / 'manifest.jsonl') as manifest_file:
+        completed = [json.loads(line)['file_name'] for line in manifest_file
+                     if 'file_name' in line]
+    assert sorted(completed) == sorted(os.listdir(seed_seg_dir))
+
+
+def test_idle_exit_waits_for_files_to_settle(dataset, tmp_path):
+    root_seg_dir, seed_seg_dir, photo_dir = dataset
+    output_dir = tmp_path / 'output'
+    os.makedirs(output_dir)
+    batch.watch_angles(root_seg_dir, photo_dir, seed_seg_dir, 2,
+                       str(output_dir / 'debug_images'),
+                       str(output_dir / 'angles.csv'),
+                       str(output_dir / 'errors.csv'),
+                       inner_radius=INNER_RADIUS, outer_radius=OUTER_RADIUS,
+                       save_debug_image=False, cpus=1, settle_seconds=1.5,
+                       poll_interval=0.1, idle_exit=0.5)
+    assert read_fnames(output_dir / 'angles.csv') == set(os.listdir(seed_seg_dir))
+
+
+def test_cache_is_evicted_while_watching(dataset, tmp_path, monkeypatch):
+    root_seg_dir, seed_seg_dir, photo_dir = dataset
+    output_dir = tmp_path / 'output'
+    os.makedirs(output_dir)
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setattr(batch, 'CACHE_EVICT_INTERVAL', 0)
+    cache_sizes = []
+
+    def progress_hook(_completed, _total):
+        cache_sizes.append(sum(os.path.getsize(cache_dir / f) for f in os.listdir(cache_dir)
+                               if f.endswith('.npz')))
+
+    batch.watch_angles(root_seg_dir, photo_dir, seed_seg_dir, 2,
+                       str(output_dir / 'debug_images'),
+                       str(output_dir / 'angles.csv'),
+                       str(output_dir / 'errors.csv'),
+                       inner_radius=INNER_RADIUS, outer_radius=OUTER_RADIUS,
+                       save_debug_image=False, cpus=1, settle_seconds=0,
+                       poll_interval=0.1, idle_exit=0.5, progress_hook=progress_hook,
+                       cache_dir=str(cache_dir), cache_max_bytes=1)
+    assert cache_sizes == [0, 0, 0]
@@ -0,0 +1,79 @@
+"""
+Copyright (C) 2023 Abraham George Smith
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# Wall and CPU time spent in each stage of extracting the angles from a file.
+
+import time
+from contextlib import contextmanager, nullcontext
+
+# stages in the order they happen. decode includes the photo.
+TIMING_STAGES = ['photo_lookup', 'decode', 'cache', 'seed_resize', 'seed_detection',
+                 'skeletonize', 'angles', 'debug_render', 'debug_encode']
+
+
+class StageTimer:
+    """
+    Time spent in each stage for one file.
+
+    Stages can be nested, in which case the time is only counted for
+    the innermost stage, i.e the time to draw on the debug image during
+    the angle extraction counts as debug_render, not angles.
+    """
+    def __init__(self):
+        self.wall = dict.fromkeys(TIMING_STAGES, 0.0)
+        self.cpu = dict.fromkeys(TIMING_STAGES, 0.0)
+        self.stack = []
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.last_wall = self.start_wall
+        self.last_cpu = self.start_cpu
+
+    def charge(self):
+        """ add the time since the last change of stage to the current stage """
+        now_wall = time.perf_counter()
+        now_cpu = time.process_time()
+        if self.stack:
+            self.wall[self.stack[-1]] += now_wall - self.last_wall
+            self.cpu[self.stack[-1]] += now_cpu - self.last_cpu
+        self.last_wall = now_wall
+        self.last_cpu = now_cpu
+
+    @contextmanager
+    def stage(self, name):
+        self.charge()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            self.charge()
+            self.stack.pop()
+
+    def get_record(self, fname, seeds):
+        """ timings for {fname} as a dict with the fields in results.TIMING_FIELDS """
+        record = {'file_name': fname, 'seeds': seeds,
+                  'total_wall_s': round(time.perf_counter() - self.start_wall, 6),
+                  'total_cpu_s': round(time.process_time() - self.start_cpu, 6)}
+        for name in TIMING_STAGES:
+            record[name + '_wall_s'] = round(self.wall[name], 6)
+            record[name + '_cpu_s'] = round(self.cpu[name], 6)
+        return record
+
+
+def stage(timer, name):
+    """ timer.stage(name), or nothing if there is no timer """
+    if timer is None:
+        return nullcontext()
+    return timer.stage(name)